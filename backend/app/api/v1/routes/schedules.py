@@ -3,11 +3,12 @@ API routes for managing schedules.
 """
 
 from datetime import datetime, timezone
+from itertools import batched
 from uuid import UUID, uuid4
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import StreamingResponse
-from sqlalchemy import func, select
+from sqlalchemy import delete, func, insert, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.v1.schemas.schedule import (
@@ -18,6 +19,7 @@ from app.api.v1.schemas.schedule import (
     ScheduleResponse,
     ScheduleUpdate,
 )
+from app.cache import RedisCache, get_redis_client
 from app.core.dependencies import get_current_user
 from app.db.models.institution import Institution
 from app.db.models.schedule import Schedule
@@ -30,6 +32,9 @@ from app.storage.s3 import get_s3_client
 
 router = APIRouter(prefix="/schedules", tags=["Schedules"])
 
+# Rows per multi-row INSERT when saving generated entries.
+ENTRY_INSERT_BATCH_SIZE = 1000
+
 
 @router.post("", status_code=status.HTTP_201_CREATED, response_model=ScheduleResponse)
 async def create_schedule(
@@ -292,6 +297,7 @@ async def generate_schedule(
     request: ScheduleGenerateRequest,
     current_user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db_session),
+    redis_client: RedisCache = Depends(get_redis_client),
 ) -> ScheduleGenerateResponse:
     """Generate schedule using SAT solver."""
     result = await db.execute(
@@ -304,7 +310,7 @@ async def generate_schedule(
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Schedule not found"
         )
-    generator = ScheduleGenerator(db)
+    generator = ScheduleGenerator(db, cache=redis_client)
     success, schedule_entries, error = await generator.generate(
         schedule.institution_id, timeout=request.timeout
     )
@@ -313,25 +319,23 @@ async def generate_schedule(
         return ScheduleGenerateResponse(
             success=False, message=error or "Generation failed", entries_count=None
         )
-    result = await db.execute(
-        select(ScheduleEntry).where(ScheduleEntry.schedule_id == schedule_id)
+    await db.execute(
+        delete(ScheduleEntry).where(ScheduleEntry.schedule_id == schedule_id)
     )
-    old_entries = result.scalars().all()
-    for entry in old_entries:
-        await db.delete(entry)
-    for entry_data in schedule_entries:
-        entry = ScheduleEntry(
-            id=uuid4(),
-            institution_id=schedule.institution_id,
-            schedule_id=schedule_id,
-            lesson_id=entry_data["lesson_id"],
-            teacher_id=entry_data["teacher_id"],
-            class_group_id=entry_data.get("class_group_id"),
-            study_group_id=entry_data.get("study_group_id"),
-            room_id=entry_data["room_id"],
-            time_slot_id=entry_data["time_slot_id"],
+    # Пакетная вставка вместо отдельного ORM-объекта на каждую запись
+    for batch in batched(schedule_entries, ENTRY_INSERT_BATCH_SIZE):
+        await db.execute(
+            insert(ScheduleEntry),
+            [
+                {
+                    "id": uuid4(),
+                    "institution_id": schedule.institution_id,
+                    "schedule_id": schedule_id,
+                    **entry._asdict(),
+                }
+                for entry in batch
+            ],
         )
-        db.add(entry)
     schedule.status = "generated"
     schedule.generated_at = datetime.now(timezone.utc)
 
@@ -1,7 +1,8 @@
 from typing import List
 
-from pydantic import AliasChoices, Field
+from pydantic import AliasChoices, Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from pysat.solvers import SolverNames
 
 
 class Settings(BaseSettings):
@@ -32,6 +33,18 @@ class Settings(BaseSettings):
     REDIS_PORT: int = 6379
     REDIS_DB: int = 0
     REDIS_PASSWORD: str | None = None
+    SCHEDULER_CACHE_DIR: str | None = Field(
+        None,
+        description=(
+            "Directory for caching scheduler encodings (disabled if unset). The "
+            "files are loaded with pickle, so it must be private to the app."
+        ),
+    )
+    SCHEDULER_CACHE_MAX_ENTRIES: int = 64
+    SCHEDULER_ROOM_SYMMETRY_BREAKING: bool = False
+    SCHEDULER_TEACHER_SYMMETRY_BREAKING: bool = False
+    SCHEDULER_RESULT_CACHE_TTL: int = 60 * 60 * 24 * 7
+    SCHEDULER_PORTFOLIO_SOLVERS: List[str] = ["cadical153"]
 
     CSRF_SECRET_KEY: str = "secret"
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
@@ -66,6 +79,23 @@ class Settings(BaseSettings):
         description="Frontend URL for email links (without port)",
     )
 
+    @field_validator("SCHEDULER_PORTFOLIO_SOLVERS")
+    @classmethod
+    def validate_portfolio_solvers(cls, v: List[str]) -> List[str]:
+        """Reject solver names pysat does not know, so a typo fails at startup."""
+        if not v:
+            raise ValueError("At least one portfolio solver is required")
+        known = {
+            name
+            for names in vars(SolverNames).values()
+            if isinstance(names, tuple)
+            for name in names
+        }
+        unknown = [name for name in v if name not in known]
+        if unknown:
+            raise ValueError(f"Unknown pysat solvers: {', '.join(unknown)}")
+        return v
+
     @property
     def REDIS_URL(self) -> str:
         """Return a full Redis URL (redis:// or rediss://)."""
@@ -22,7 +22,8 @@ from app.api.v1.routes import (
 from app.core.config import settings
 from app.core.logger import logger
 from app.db.session import engine
-from app.storage.s3 import get_s3_client
+from app.scheduler.schedule_generator import stop_solver_processes
+from app.storage.s3 import close_s3_client, get_s3_client
 
 
 @asynccontextmanager
@@ -34,14 +35,16 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.error(f"❌ Database connection failed: {e}")
     try:
-        s3_storage = await get_s3_client()
-        await s3_storage.ensure_bucket_exists()
+        # Creates the bucket once, on first use of the shared client.
+        await get_s3_client()
         logger.info("✅ S3 storage initialized successfully!")
     except Exception as e:
         logger.error(f"❌ S3 storage initialization failed: {e}")
 
     logger.info(f"🚀 {settings.APP_NAME} started!")
     yield
+    stop_solver_processes()
+    await close_s3_client()
     await engine.dispose()
     logger.info("🔌 Database connections closed")
 
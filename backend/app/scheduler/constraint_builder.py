@@ -2,10 +2,11 @@
 Module for building constraints from database data.
 """
 
+from collections import defaultdict
 from typing import Dict, List, Set
 from uuid import UUID
 
-from sqlalchemy import select
+from sqlalchemy import exists, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.models import (
@@ -32,6 +33,31 @@ class ConstraintBuilder:
     def __init__(self, db: AsyncSession):
         self.db = db
 
+    async def probe_institution(self, institution_id: UUID) -> Dict[str, bool]:
+        """
+        Checks which kinds of entities the institution has, in one query.
+
+        Returns:
+            {"lessons": bool, "teachers": bool, "class_groups": bool,
+             "study_groups": bool, "rooms": bool, "time_slots": bool}
+        """
+        result = await self.db.execute(
+            select(
+                *(
+                    exists().where(model.institution_id == institution_id).label(name)
+                    for name, model in (
+                        ("lessons", Lesson),
+                        ("teachers", Teacher),
+                        ("class_groups", ClassGroup),
+                        ("study_groups", StudyGroup),
+                        ("rooms", Room),
+                        ("time_slots", TimeSlot),
+                    )
+                )
+            )
+        )
+        return dict(result.one()._mapping)
+
     async def build_from_institution(self, institution_id: UUID) -> Dict:
         """
         Loads all institution data and builds structure for schedule generation.
@@ -56,58 +82,75 @@ class ConstraintBuilder:
                 "constraints": [...]
             }
         """
-        lessons_result = await self.db.execute(
-            select(Lesson).where(Lesson.institution_id == institution_id)
-        )
-        lessons = lessons_result.scalars().all()
+        return (await self.build_many([institution_id]))[institution_id]
 
-        teachers_result = await self.db.execute(
-            select(Teacher).where(Teacher.institution_id == institution_id)
-        )
-        teachers = teachers_result.scalars().all()
+    async def build_many(self, institution_ids: List[UUID]) -> Dict[UUID, Dict]:
+        """
+        Builds generation data for several institutions at once.
 
-        class_groups_result = await self.db.execute(
-            select(ClassGroup).where(ClassGroup.institution_id == institution_id)
-        )
-        class_groups = class_groups_result.scalars().all()
+        Each table is read with one ``IN`` query for all institutions and the rows
+        are dispatched by institution, instead of one full build per institution.
 
-        rooms_result = await self.db.execute(
-            select(Room).where(Room.institution_id == institution_id)
-        )
-        rooms = rooms_result.scalars().all()
+        Args:
+            institution_ids: Institution IDs
 
-        time_slots_result = await self.db.execute(
-            select(TimeSlot).where(TimeSlot.institution_id == institution_id)
-        )
-        time_slots = time_slots_result.scalars().all()
-        teacher_lessons_dict: Dict[int, Set[UUID]] = {t.id: set() for t in teachers}
-        if teachers:
+        Returns:
+            {institution_id: data}, data as returned by build_from_institution
+        """
+        ids = list(dict.fromkeys(institution_ids))
+        by_institution: Dict[UUID, Dict[str, list]] = {
+            inst_id: defaultdict(list) for inst_id in ids
+        }
+        if not ids:
+            return {}
+
+        for name, model in (
+            ("lessons", Lesson),
+            ("teachers", Teacher),
+            ("class_groups", ClassGroup),
+            ("rooms", Room),
+            ("time_slots", TimeSlot),
+            ("constraints", Constraint),
+            ("study_groups", StudyGroup),
+        ):
+            result = await self.db.execute(
+                select(model).where(model.institution_id.in_(ids))
+            )
+            for row in result.scalars().all():
+                by_institution[row.institution_id][name].append(row)
+
+        teacher_institution = {
+            t.id: inst_id
+            for inst_id, rows in by_institution.items()
+            for t in rows["teachers"]
+        }
+        class_group_institution = {
+            cg.id: inst_id
+            for inst_id, rows in by_institution.items()
+            for cg in rows["class_groups"]
+        }
+        study_groups_all = [
+            sg for rows in by_institution.values() for sg in rows["study_groups"]
+        ]
+
+        teacher_lessons_dict: Dict[int, Set[UUID]] = {
+            t_id: set() for t_id in teacher_institution
+        }
+        if teacher_institution:
             tl_result = await self.db.execute(
                 select(TeacherLesson).where(
-                    TeacherLesson.teacher_id.in_([t.id for t in teachers])
+                    TeacherLesson.teacher_id.in_(list(teacher_institution))
                 )
             )
             for tl in tl_result.scalars().all():
                 teacher_lessons_dict[tl.teacher_id].add(tl.lesson_id)
-        constraints_result = await self.db.execute(
-            select(Constraint).where(Constraint.institution_id == institution_id)
-        )
-        constraints = constraints_result.scalars().all()
-        study_groups_result = await self.db.execute(
-            select(StudyGroup).where(StudyGroup.institution_id == institution_id)
-        )
-        study_groups = study_groups_result.scalars().all()
-        room_capacities = {room.id: room.capacity for room in rooms}
-        class_group_sizes = {cg.id: cg.student_count for cg in class_groups}
-        study_group_sizes = {}
-        student_group_memberships: Dict[UUID, Dict] = {}
 
         class_group_lessons_dict: Dict[UUID, Dict[UUID, int]] = {}
-        if class_groups:
+        if class_group_institution:
             cg_lessons_result = await self.db.execute(
                 select(class_group_lessons).where(
                     class_group_lessons.c.class_group_id.in_(
-                        [cg.id for cg in class_groups]
+                        list(class_group_institution)
                     )
                 )
             )
@@ -118,12 +161,14 @@ class ConstraintBuilder:
                 class_group_lessons_dict[cg_id][row.lesson_id] = row._mapping["count"]
 
         study_group_lessons_dict: Dict[UUID, Dict[UUID, int]] = {}
-        if study_groups:
+        sg_to_students: Dict[UUID, List[Student]] = {
+            sg.id: [] for sg in study_groups_all
+        }
+        if study_groups_all:
+            sg_ids = [sg.id for sg in study_groups_all]
             sg_lessons_result = await self.db.execute(
                 select(study_group_lessons).where(
-                    study_group_lessons.c.study_group_id.in_(
-                        [sg.id for sg in study_groups]
-                    )
+                    study_group_lessons.c.study_group_id.in_(sg_ids)
                 )
             )
             for row in sg_lessons_result.all():
@@ -132,8 +177,6 @@ class ConstraintBuilder:
                     study_group_lessons_dict[sgg_id] = {}
                 study_group_lessons_dict[sgg_id][row.lesson_id] = row._mapping["count"]
 
-        if study_groups:
-            sg_ids = [sg.id for sg in study_groups]
             sg_students_result = await self.db.execute(
                 select(Student, study_group_student.c.study_group_id)
                 .select_from(Student)
@@ -142,25 +185,52 @@ class ConstraintBuilder:
                 )
                 .where(study_group_student.c.study_group_id.in_(sg_ids))
             )
-            sg_to_students: Dict[UUID, List[Student]] = {
-                sg.id: [] for sg in study_groups
-            }
             for student, sg_id in sg_students_result.all():
                 sg_to_students[sg_id].append(student)
-            for sg in study_groups:
-                students = sg_to_students.get(sg.id, [])
-                study_group_sizes[sg.id] = len(students)
-                for student in students:
-                    if student.id not in student_group_memberships:
-                        student_group_memberships[student.id] = {
-                            "class_group_id": student.class_group_id,
-                            "study_group_ids": [],
-                        }
-                    student_group_memberships[student.id]["study_group_ids"].append(
-                        sg.id
-                    )
+
+        return {
+            inst_id: self._assemble(
+                by_institution[inst_id],
+                teacher_lessons_dict,
+                class_group_lessons_dict,
+                study_group_lessons_dict,
+                sg_to_students,
+            )
+            for inst_id in ids
+        }
+
+    @staticmethod
+    def _assemble(
+        rows: Dict[str, list],
+        teacher_lessons: Dict[int, Set[UUID]],
+        class_group_lessons_all: Dict[UUID, Dict[UUID, int]],
+        study_group_lessons_all: Dict[UUID, Dict[UUID, int]],
+        sg_to_students: Dict[UUID, List[Student]],
+    ) -> Dict:
+        """Builds one institution's data from its rows and the shared link tables."""
+        lessons = rows["lessons"]
+        teachers = rows["teachers"]
+        class_groups = rows["class_groups"]
+        study_groups = rows["study_groups"]
+        rooms = rows["rooms"]
+        time_slots = rows["time_slots"]
+
+        room_capacities = {room.id: room.capacity for room in rooms}
+        class_group_sizes = {cg.id: cg.student_count for cg in class_groups}
+        study_group_sizes = {}
+        student_group_memberships: Dict[UUID, Dict] = {}
+        for sg in study_groups:
+            students = sg_to_students.get(sg.id, [])
+            study_group_sizes[sg.id] = len(students)
+            for student in students:
+                if student.id not in student_group_memberships:
+                    student_group_memberships[student.id] = {
+                        "class_group_id": student.class_group_id,
+                        "study_group_ids": [],
+                    }
+                student_group_memberships[student.id]["study_group_ids"].append(sg.id)
         constraints_list = []
-        for constraint in constraints:
+        for constraint in rows["constraints"]:
             constraints_list.append(
                 {
                     "constraint_type": constraint.constraint_type,
@@ -176,9 +246,17 @@ class ConstraintBuilder:
             "study_groups": [sg.id for sg in study_groups],
             "rooms": [room.id for room in rooms],
             "time_slots": [ts.id for ts in time_slots],
-            "teacher_lessons": teacher_lessons_dict,
-            "class_group_lessons": class_group_lessons_dict,
-            "study_group_lessons": study_group_lessons_dict,
+            "teacher_lessons": {t.id: teacher_lessons[t.id] for t in teachers},
+            "class_group_lessons": {
+                cg.id: class_group_lessons_all[cg.id]
+                for cg in class_groups
+                if cg.id in class_group_lessons_all
+            },
+            "study_group_lessons": {
+                sg.id: study_group_lessons_all[sg.id]
+                for sg in study_groups
+                if sg.id in study_group_lessons_all
+            },
             "room_capacities": room_capacities,
             "class_group_sizes": class_group_sizes,
             "study_group_sizes": study_group_sizes,
@@ -2,13 +2,117 @@
 Module for converting schedule constraints to CNF formula.
 """
 
-from typing import Dict, List, Set, Tuple
+import copy
+import hashlib
+import logging
+import os
+import pickle
+import sys
+from collections import defaultdict
+from itertools import combinations
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 from uuid import UUID
 
 from pysat.card import CardEnc, EncType
 from pysat.formula import CNF
 from pysat.solvers import Solver
 
+logger = logging.getLogger(__name__)
+
+
+def _sorted(items: List[Any]) -> List[Any]:
+    """Sorts naturally, or by repr when the items are not mutually comparable."""
+    try:
+        return sorted(items)
+    except TypeError:
+        return sorted(items, key=repr)
+
+
+def _canonical(obj: Any) -> Any:
+    """Convert input data to an order-independent, picklable form for hashing."""
+    if isinstance(obj, dict):
+        return tuple(_sorted([(k, _canonical(v)) for k, v in obj.items()]))
+    if isinstance(obj, (set, frozenset, list)):
+        return tuple(_sorted([_canonical(x) for x in obj]))
+    if isinstance(obj, tuple):
+        return tuple(_canonical(x) for x in obj)
+    return obj
+
+
+def fingerprint(obj: Any) -> str:
+    """Stable hex digest of ``obj`` that ignores dict, set and list ordering."""
+    return hashlib.blake2b(
+        pickle.dumps(_canonical(obj), protocol=4), digest_size=20
+    ).hexdigest()
+
+
+# Positions of the fields in a (lesson, teacher, group, room, time_slot) key.
+_LESSON, _TEACHER, _GROUP, _ROOM, _TIME_SLOT = range(5)
+
+
+def unavailable_slots(
+    constraints: List[Dict],
+) -> Tuple[Dict[int, Set[UUID]], Dict[UUID, Set[UUID]]]:
+    """
+    Collects the teacher_unavailable and room_unavailable constraints into
+    teacher_id -> time slots and room_id -> time slots maps.
+    """
+    teachers: Dict[int, Set[UUID]] = defaultdict(set)
+    rooms: Dict[UUID, Set[UUID]] = defaultdict(set)
+    for constraint in constraints:
+        constraint_type = constraint.get("constraint_type")
+        constraint_data = constraint.get("constraint_data", {})
+        if constraint_type == "teacher_unavailable":
+            target = teachers[constraint_data.get("teacher_id")]
+        elif constraint_type == "room_unavailable":
+            target = rooms[constraint_data.get("room_id")]
+        else:
+            continue
+        target.update(constraint_data.get("time_slot_ids", []))
+    return dict(teachers), dict(rooms)
+
+
+def _amo_aux_count(size: int, pairwise_max: int) -> int:
+    """Number of auxiliary variables _amo_clauses allocates for a bucket."""
+    return size - 1 if size > pairwise_max else 0
+
+
+def _amo_clauses(lits: List[int], first_aux: int, pairwise_max: int) -> List[List[int]]:
+    """
+    At-most-one clauses for ``lits``.
+
+    Buckets larger than ``pairwise_max`` use the sequential counter encoding
+    (Sinz, 2005): k-1 auxiliary variables s_i ("some x_j with j <= i is true"),
+    numbered from ``first_aux``, and 3k-4 clauses x_i -> s_i, s_{i-1} -> s_i and
+    x_i -> not s_{i-1}. Smaller buckets get pairwise clauses.
+    """
+    k = len(lits)
+    if k < 2:
+        return []
+    if k <= pairwise_max:
+        return [[-a, -b] for a, b in combinations(lits, 2)]
+    clauses = [[-lits[0], first_aux]]
+    for i in range(1, k - 1):
+        s_prev = first_aux + i - 1
+        s_cur = s_prev + 1
+        x = lits[i]
+        clauses.append([-x, s_cur])
+        clauses.append([-s_prev, s_cur])
+        clauses.append([-x, -s_prev])
+    clauses.append([-lits[k - 1], -(first_aux + k - 2)])
+    return clauses
+
 
 class ScheduleEncoder:
     """
@@ -18,12 +122,111 @@ class ScheduleEncoder:
     (lesson, teacher, class_group, room, time_slot)
     """
 
-    def __init__(self):
-        self.variables: Dict[Tuple[UUID, int, UUID, UUID, UUID], int] = {}
-        self.reverse_variables: Dict[int, Tuple[UUID, int, UUID, UUID, UUID]] = {}
+    # Buckets up to this size get pairwise at-most-one clauses even when the
+    # sequential encoding is enabled: k(k-1)/2 binary clauses and no auxiliary
+    # variables are no larger than its 3k-4 clauses plus k-1 auxiliaries.
+    PAIRWISE_AMO_MAX = 5
+
+    __slots__ = (
+        "cache_dir",
+        "cache_max_entries",
+        "use_sequential_amo",
+        "variables",
+        "reverse_variables",
+        "_axis_ids",
+        "_axis_shifts",
+        "_axis_bits",
+        "_axis_keys",
+        "group_types",
+        "class_group_ids",
+        "_by_lesson_group",
+        "_taught_lessons",
+        "_unavailable_pairs",
+        "_by_ts_teacher",
+        "_by_ts_group",
+        "_by_ts_room",
+        "_busy_vars",
+        "next_var",
+        "_clauses",
+        "_conflict_spans",
+    )
+
+    # Bumped whenever the layout of the cached attributes below changes, so
+    # files written by older versions are not picked up.
+    _CACHE_FORMAT = 5
+
+    # Attributes produced by encode_variables and persisted in the on-disk cache.
+    _VARIABLE_STATE = (
+        "variables",
+        "reverse_variables",
+        "_axis_ids",
+        "_axis_shifts",
+        "_axis_bits",
+        "_axis_keys",
+        "group_types",
+        "class_group_ids",
+        "_by_lesson_group",
+        "_taught_lessons",
+        "_unavailable_pairs",
+        "_by_ts_teacher",
+        "_by_ts_group",
+        "_by_ts_room",
+        "next_var",
+    )
+
+    def __init__(
+        self,
+        cache_dir: Optional[Path] = None,
+        use_sequential_amo: bool = True,
+        cache_max_entries: int = 64,
+    ):
+        """
+        Args:
+            cache_dir: Directory for caching the variable universe between runs
+                with identical inputs. Caching is disabled when None. The files
+                are pickles, so the directory must only be writable by the app.
+            use_sequential_amo: Encode at-most-one constraints with the sequential
+                (Sinz) encoding, O(k) clauses, instead of O(k^2) pairwise clauses.
+            cache_max_entries: Cache files kept in ``cache_dir``; the least
+                recently used ones are deleted beyond this.
+        """
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self.use_sequential_amo = use_sequential_amo
+        # Variables are keyed by a packed int: each (lesson, teacher, group, room,
+        # time_slot) field is replaced by its index in _axis_ids and stored in its
+        # own bit range (see _pack_key / _unpack_key).
+        self.variables: Dict[int, int] = {}
+        # Packed key of variable v at index v - 1; encode_variables numbers the
+        # combination variables 1..N before any auxiliary variable is allocated.
+        self.reverse_variables: List[int] = []
+        self._axis_ids: Tuple[List[Any], ...] = ([], [], [], [], [])
+        self._axis_shifts: Tuple[int, ...] = (0, 0, 0, 0, 0)
+        self._axis_bits: Tuple[int, ...] = (0, 0, 0, 0, 0)
+        # Per field: id -> its index already shifted into place, so a packed key
+        # is the OR of one entry per field.
+        self._axis_keys: Tuple[Dict[Any, int], ...] = ({}, {}, {}, {}, {})
         self.group_types: Dict[UUID, str] = {}
+        # Membership test for decoding rows without a per-row tag comparison.
+        self.class_group_ids: FrozenSet[UUID] = frozenset()
+        # Buckets are keyed by the packed fields they group (see _bucket).
+        # (lesson_id, group_id) -> [var, ...]
+        self._by_lesson_group: Dict[int, List[int]] = defaultdict(list)
+        # Lessons that at least one teacher can teach (used by diagnostics).
+        self._taught_lessons: Set[UUID] = set()
+        # (lesson_id, group_id) pairs that lost variables to unavailability.
+        self._unavailable_pairs: Set[Tuple[UUID, UUID]] = set()
+        # (teacher_id | group_id | room_id, time_slot_id) -> [var, ...]
+        self._by_ts_teacher: Dict[int, List[int]] = defaultdict(list)
+        self._by_ts_group: Dict[int, List[int]] = defaultdict(list)
+        self._by_ts_room: Dict[int, List[int]] = defaultdict(list)
+        # (group_id, time_slot_id) -> literal implied by every lesson of the group
+        # in that slot; shared by all student-overlap clauses.
+        self._busy_vars: Dict[int, int] = {}
         self.next_var = 1
-        self.cnf = CNF()
+        self._clauses: List[List[int]] = []
+        # [start, end) ranges of _clauses emitted for conflict constraints
+        self._conflict_spans: List[Tuple[int, int]] = []
 
     def encode_variables(
         self,
@@ -36,128 +239,309 @@ class ScheduleEncoder:
         teacher_lessons: Dict[int, Set[UUID]],
         class_group_lessons: Dict[UUID, Dict[UUID, int]],
         study_group_lessons: Dict[UUID, Dict[UUID, int]],
+        room_capacities: Dict[UUID, int],
+        class_group_sizes: Dict[UUID, int],
+        study_group_sizes: Dict[UUID, int],
+        teacher_unavailability: Optional[Dict[int, Set[UUID]]] = None,
+        room_unavailability: Optional[Dict[UUID, Set[UUID]]] = None,
     ) -> None:
         """
         Creates boolean variables for all possible combinations.
 
         Only creates variables for (lesson, group) pairs that exist in
-        class_group_lessons or study_group_lessons.
+        class_group_lessons or study_group_lessons, for teachers that can teach
+        the lesson and for rooms large enough for the group. Teachers and rooms
+        get no variables in the time slots listed in teacher_unavailability and
+        room_unavailability (see unavailable_slots).
+
+        When ``cache_dir`` is set, the result is loaded from (or stored to) a
+        file keyed by a fingerprint of the inputs.
         """
+        cache_path: Optional[Path] = None
+        if self.cache_dir is not None:
+            key = fingerprint(
+                (
+                    self._CACHE_FORMAT,
+                    lessons,
+                    teachers,
+                    class_groups,
+                    study_groups,
+                    rooms,
+                    time_slots,
+                    teacher_lessons,
+                    class_group_lessons,
+                    study_group_lessons,
+                    room_capacities,
+                    class_group_sizes,
+                    study_group_sizes,
+                    teacher_unavailability,
+                    room_unavailability,
+                )
+            )
+            cache_path = Path(self.cache_dir) / f"{key}.pkl"
+            if self._load_variable_state(cache_path):
+                return
+
         for cg_id in class_groups:
             self.group_types[cg_id] = "class_group"
         for sg_id in study_groups:
             self.group_types[sg_id] = "study_group"
+        self.class_group_ids = frozenset(class_groups)
 
-        all_groups = class_groups + study_groups
+        self._axis_ids = tuple(
+            list(dict.fromkeys(ids))
+            for ids in (
+                lessons,
+                teachers,
+                class_groups + study_groups,
+                rooms,
+                time_slots,
+            )
+        )
+        self._axis_bits = tuple(
+            max(1, (len(ids) - 1).bit_length()) for ids in self._axis_ids
+        )
+        shifts = []
+        shift = 0
+        for bits in reversed(self._axis_bits):
+            shifts.append(shift)
+            shift += bits
+        self._axis_shifts = tuple(reversed(shifts))
+        self._axis_keys = tuple(
+            {value: i << shift for i, value in enumerate(ids)}
+            for ids, shift in zip(self._axis_ids, self._axis_shifts)
+        )
+        lesson_bits, teacher_bits, group_bits, room_bits, ts_bits = self._axis_keys
 
-        for lesson_id in lessons:
-            for teacher_id in teachers:
-                if lesson_id not in teacher_lessons.get(teacher_id, set()):
+        # Only packed indices are needed below: lesson -> teacher indices.
+        lesson_to_teachers: Dict[UUID, List[int]] = defaultdict(list)
+        for teacher_id in teachers:
+            for lesson_id in teacher_lessons.get(teacher_id, ()):
+                lesson_to_teachers[lesson_id].append(teacher_bits[teacher_id])
+        self._taught_lessons = set(lesson_to_teachers)
+
+        # Per lesson: the groups that take it, with their packed index and the
+        # packed indices of the rooms that can hold them (groups in input order).
+        # Groups of equal size share one list of fitting rooms.
+        GroupPlan = Tuple[UUID, int, List[int]]
+        lesson_to_groups: Dict[UUID, List[GroupPlan]] = defaultdict(list)
+        room_plan = [
+            (room_capacities.get(room_id, 0), room_bits[room_id]) for room_id in rooms
+        ]
+        rooms_by_size: Dict[int, List[int]] = {}
+        for group_ids, group_lessons, group_sizes in (
+            (class_groups, class_group_lessons, class_group_sizes),
+            (study_groups, study_group_lessons, study_group_sizes),
+        ):
+            for group_id in group_ids:
+                group_size = group_sizes.get(group_id, 0)
+                fitting_rooms = rooms_by_size.get(group_size)
+                if fitting_rooms is None:
+                    fitting_rooms = rooms_by_size[group_size] = [
+                        room_key
+                        for capacity, room_key in room_plan
+                        if capacity >= group_size
+                    ]
+                if not fitting_rooms:
                     continue
+                group_plan = (group_id, group_bits[group_id], fitting_rooms)
+                for lesson_id in group_lessons.get(group_id, {}):
+                    lesson_to_groups[lesson_id].append(group_plan)
+        # time_slot_id -> packed teacher / room indices unavailable in the slot
+        blocked_teachers: Dict[UUID, Set[int]] = defaultdict(set)
+        for teacher_id, slot_ids in (teacher_unavailability or {}).items():
+            if teacher_id in teacher_bits:
+                for time_slot_id in slot_ids:
+                    blocked_teachers[time_slot_id].add(teacher_bits[teacher_id])
+        blocked_rooms: Dict[UUID, Set[int]] = defaultdict(set)
+        for room_id, slot_ids in (room_unavailability or {}).items():
+            if room_id in room_bits:
+                for time_slot_id in slot_ids:
+                    blocked_rooms[time_slot_id].add(room_bits[room_id])
+        time_slot_plan = [
+            (
+                ts_bits[ts_id],
+                blocked_teachers.get(ts_id, frozenset()),
+                blocked_rooms.get(ts_id, frozenset()),
+            )
+            for ts_id in time_slots
+        ]
 
-                for group_id in all_groups:
-                    group_type = self.group_types.get(group_id, "class_group")
-                    if group_type == "class_group":
-                        if lesson_id not in class_group_lessons.get(group_id, {}):
-                            continue
-                    else:
-                        if lesson_id not in study_group_lessons.get(group_id, {}):
+        variables = self.variables
+        reverse_variables = self.reverse_variables
+        by_lesson_group = self._by_lesson_group
+        by_ts_teacher = self._by_ts_teacher
+        by_ts_group = self._by_ts_group
+        by_ts_room = self._by_ts_room
+        var = self.next_var
+        for lesson_id in lessons:
+            lesson_teachers = lesson_to_teachers.get(lesson_id)
+            if not lesson_teachers:
+                continue
+            lesson_key = lesson_bits[lesson_id]
+            for group_id, group_key, fitting_rooms in lesson_to_groups.get(
+                lesson_id, ()
+            ):
+                lesson_group_key = lesson_key | group_key
+                lesson_bucket = by_lesson_group[lesson_group_key]
+                pruned = False
+                for ts_key, slot_blocked_teachers, slot_blocked_rooms in time_slot_plan:
+                    group_bucket = by_ts_group[group_key | ts_key]
+                    slot_key = lesson_group_key | ts_key
+                    for teacher_key in lesson_teachers:
+                        if teacher_key in slot_blocked_teachers:
+                            pruned = True
                             continue
+                        teacher_bucket = by_ts_teacher[teacher_key | ts_key]
+                        base_key = slot_key | teacher_key
+                        for room_key in fitting_rooms:
+                            if room_key in slot_blocked_rooms:
+                                pruned = True
+                                continue
+                            key = base_key | room_key
+                            if key in variables:
+                                continue
+                            variables[key] = var
+                            reverse_variables.append(key)
+                            lesson_bucket.append(var)
+                            group_bucket.append(var)
+                            teacher_bucket.append(var)
+                            by_ts_room[room_key | ts_key].append(var)
+                            var += 1
+                if pruned:
+                    self._unavailable_pairs.add((lesson_id, group_id))
+        self.next_var = var
 
-                    for room_id in rooms:
-                        for time_slot_id in time_slots:
-                            key = (
-                                lesson_id,
-                                teacher_id,
-                                group_id,
-                                room_id,
-                                time_slot_id,
-                            )
-                            if key not in self.variables:
-                                self.variables[key] = self.next_var
-                                self.reverse_variables[self.next_var] = key
-                                self.next_var += 1
+        if cache_path is not None:
+            self._dump_variable_state(cache_path)
+
+    def _load_variable_state(self, path: Path) -> bool:
+        """Restores encode_variables output from ``path``; returns True on success."""
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning("Could not read encoder cache %s: %s", path, e)
+            return False
+        if not all(name in state for name in self._VARIABLE_STATE):
+            return False
+        for name in self._VARIABLE_STATE:
+            setattr(self, name, state[name])
+        try:
+            # Marks the file as recently used for _prune_cache.
+            os.utime(path)
+        except OSError:
+            pass
+        return True
+
+    def _pack_key(self, key: Tuple[UUID, int, UUID, UUID, UUID]) -> Optional[int]:
+        """Packs a (lesson, teacher, group, room, time_slot) tuple; None if unknown."""
+        packed = 0
+        for value, keys in zip(key, self._axis_keys):
+            bits = keys.get(value)
+            if bits is None:
+                return None
+            packed |= bits
+        return packed
+
+    def _bucket(
+        self, buckets: Dict[int, List[int]], *fields: Tuple[int, Any]
+    ) -> Sequence[int]:
+        """
+        Returns the bucket for the given (field position, id) pairs, e.g.
+        ``_bucket(self._by_ts_room, (_ROOM, room_id), (_TIME_SLOT, ts_id))``.
+        """
+        packed = 0
+        for axis, value in fields:
+            bits = self._axis_keys[axis].get(value)
+            if bits is None:
+                return ()
+            packed |= bits
+        return buckets.get(packed, ())
+
+    def _field_keys(self, axis: int, values: List[Any]) -> List[int]:
+        """Shifted indices of the known ``values`` of one field, in order."""
+        keys = self._axis_keys[axis]
+        return [keys[value] for value in values if value in keys]
+
+    def _unpack_key(self, packed: int) -> Tuple[UUID, int, UUID, UUID, UUID]:
+        """Inverse of _pack_key."""
+        return tuple(
+            ids[(packed >> shift) & ((1 << bits) - 1)]
+            for ids, shift, bits in zip(
+                self._axis_ids, self._axis_shifts, self._axis_bits
+            )
+        )
+
+    def _dump_variable_state(self, path: Path) -> None:
+        """Stores encode_variables output to ``path`` (written atomically)."""
+        state = {name: getattr(self, name) for name in self._VARIABLE_STATE}
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("Could not write encoder cache %s: %s", path, e)
+            return
+        self._prune_cache(path.parent)
+
+    def _prune_cache(self, directory: Path) -> None:
+        """Deletes the least recently used cache files beyond cache_max_entries."""
+        try:
+            files = sorted(
+                (
+                    entry
+                    for entry in os.scandir(directory)
+                    if entry.name.endswith(".pkl")
+                ),
+                key=lambda entry: entry.stat().st_mtime_ns,
+            )
+            for entry in files[: max(0, len(files) - self.cache_max_entries)]:
+                os.unlink(entry.path)
+        except OSError as e:
+            logger.warning("Could not prune encoder cache %s: %s", directory, e)
 
     def get_infeasible_pairs(
         self,
         class_group_lessons: Dict[UUID, Dict[UUID, int]],
         study_group_lessons: Dict[UUID, Dict[UUID, int]],
-        room_capacities: Dict[UUID, int],
-        class_group_sizes: Dict[UUID, int],
-        study_group_sizes: Dict[UUID, int],
     ) -> List[Tuple[UUID, UUID, str]]:
         """
         Returns (lesson_id, group_id, reason) for (lesson, group) pairs that have
-        no valid variable (no teacher), only variables with insufficient room capacity,
-        or fewer valid (teacher, room, time slot) combinations than the required count.
+        no valid variable (no teacher, or no room with sufficient capacity), or
+        fewer valid (teacher, room, time slot) combinations than the required count.
         """
         result: List[Tuple[UUID, UUID, str]] = []
-        for cg_id, lessons_dict in class_group_lessons.items():
-            for lesson_id, count in lessons_dict.items():
-                vars_for = [
-                    (var, key)
-                    for key, var in self.variables.items()
-                    if key[0] == lesson_id and key[2] == cg_id
-                ]
-                if not vars_for:
-                    result.append(
-                        (
-                            lesson_id,
-                            cg_id,
-                            "no teacher is assigned to teach this lesson for this group",
-                        )
-                    )
-                    continue
-                if len(vars_for) < count:
-                    result.append(
-                        (
-                            lesson_id,
-                            cg_id,
-                            "need {} lesson placements but only {} valid (teacher, room, time slot) combination(s) — add more time slots or resources".format(
-                                count, len(vars_for)
-                            ),
-                        )
-                    )
-                    continue
-                cap = class_group_sizes.get(cg_id, 0)
-                if any(room_capacities.get(key[3], 0) >= cap for _, key in vars_for):
-                    continue
-                result.append(
-                    (lesson_id, cg_id, "no room has sufficient capacity for this group")
-                )
-        for sg_id, lessons_dict in study_group_lessons.items():
-            for lesson_id, count in lessons_dict.items():
-                vars_for = [
-                    (var, key)
-                    for key, var in self.variables.items()
-                    if key[0] == lesson_id and key[2] == sg_id
-                ]
-                if not vars_for:
-                    result.append(
-                        (
-                            lesson_id,
-                            sg_id,
-                            "no teacher is assigned to teach this lesson for this group",
-                        )
+        for group_lessons in (class_group_lessons, study_group_lessons):
+            for group_id, lessons_dict in group_lessons.items():
+                for lesson_id, count in lessons_dict.items():
+                    bucket = self._bucket(
+                        self._by_lesson_group, (_LESSON, lesson_id), (_GROUP, group_id)
                     )
-                    continue
-                if len(vars_for) < count:
-                    result.append(
-                        (
-                            lesson_id,
-                            sg_id,
-                            "need {} lesson placements but only {} valid (teacher, room, time slot) combination(s) — add more time slots or resources".format(
-                                count, len(vars_for)
-                            ),
+                    if not bucket:
+                        if lesson_id not in self._taught_lessons:
+                            reason = "no teacher is assigned to teach this lesson for this group"
+                        elif (lesson_id, group_id) in self._unavailable_pairs:
+                            reason = "its teachers or rooms are unavailable in every time slot"
+                        else:
+                            reason = "no room has sufficient capacity for this group"
+                        result.append((lesson_id, group_id, reason))
+                        continue
+                    if len(bucket) < count:
+                        result.append(
+                            (
+                                lesson_id,
+                                group_id,
+                                "need {} lesson placements but only {} valid (teacher, room, time slot) combination(s) — add more time slots or resources".format(
+                                    count, len(bucket)
+                                ),
+                            )
                         )
-                    )
-                    continue
-                cap = study_group_sizes.get(sg_id, 0)
-                if any(room_capacities.get(key[3], 0) >= cap for _, key in vars_for):
-                    continue
-                result.append(
-                    (lesson_id, sg_id, "no room has sufficient capacity for this group")
-                )
+                        continue
         return result
 
     def encode_hard_constraints(
@@ -168,9 +552,6 @@ class ScheduleEncoder:
         teachers: List[int],
         rooms: List[UUID],
         time_slots: List[UUID],
-        room_capacities: Dict[UUID, int],
-        class_group_sizes: Dict[UUID, int],
-        study_group_sizes: Dict[UUID, int],
         student_group_memberships: Dict[UUID, Dict],
         class_group_lessons: Dict[UUID, Dict[UUID, int]],
         study_group_lessons: Dict[UUID, Dict[UUID, int]],
@@ -186,179 +567,169 @@ class ScheduleEncoder:
         3. Same class/group cannot have two lessons at the same time (per group_id)
         4. Room cannot be occupied by two lessons simultaneously (conflict: room)
         5. Student set must not overlap: class vs study, study vs study (conflict: students)
-        6. Room must have sufficient capacity
 
-        If skip_conflicts=True, only (1) and (6) are applied (for diagnostic use).
+        Room capacity is enforced in encode_variables, which creates no variables
+        for rooms that are too small.
+
+        If skip_conflicts=True, only (1) is applied. The clauses for (2)-(5) are
+        also recorded as conflict spans, so without_conflicts() gives the same
+        relaxation from a full encoding; the UNSAT diagnostic relies on this.
         """
-        for cg_id in class_groups:
-            for lesson_id, count in class_group_lessons.get(cg_id, {}).items():
-                lesson_vars = [
-                    var
-                    for (l_id, t_id, g_id, r_id, ts_id), var in self.variables.items()
-                    if l_id == lesson_id and g_id == cg_id
-                ]
-                if len(lesson_vars) < count:
-                    continue
-                card_cnf = CardEnc.equals(
-                    lits=lesson_vars,
-                    bound=count,
-                    top_id=self.next_var - 1,
-                    encoding=EncType.seqcounter,
-                )
-                for cl in card_cnf.clauses:
-                    self.cnf.append(cl)
-                self.next_var = max(self.next_var, card_cnf.nv + 1)
-        for sg_id in study_groups:
-            for lesson_id, count in study_group_lessons.get(sg_id, {}).items():
-                lesson_vars = [
-                    var
-                    for (l_id, t_id, g_id, r_id, ts_id), var in self.variables.items()
-                    if l_id == lesson_id and g_id == sg_id
-                ]
-                if len(lesson_vars) < count:
+        lesson_keys, group_keys = self._axis_keys[_LESSON], self._axis_keys[_GROUP]
+        by_lesson_group = self._by_lesson_group
+        for group_ids, group_lessons in (
+            (class_groups, class_group_lessons),
+            (study_groups, study_group_lessons),
+        ):
+            for group_id in group_ids:
+                group_key = group_keys.get(group_id)
+                if group_key is None:
                     continue
-                card_cnf = CardEnc.equals(
-                    lits=lesson_vars,
-                    bound=count,
-                    top_id=self.next_var - 1,
-                    encoding=EncType.seqcounter,
-                )
-                for cl in card_cnf.clauses:
-                    self.cnf.append(cl)
-                self.next_var = max(self.next_var, card_cnf.nv + 1)
+                for lesson_id, count in group_lessons.get(group_id, {}).items():
+                    lesson_key = lesson_keys.get(lesson_id)
+                    if lesson_key is None:
+                        continue
+                    lesson_vars = by_lesson_group.get(lesson_key | group_key, ())
+                    if len(lesson_vars) < count:
+                        continue
+                    if len(lesson_vars) == count:
+                        # Every candidate is needed (typically a single one left
+                        # after pruning): unit clauses, no cardinality encoding.
+                        self._clauses.extend([v] for v in lesson_vars)
+                        continue
+                    self._encode_exactly(lesson_vars, count)
 
         if not skip_conflicts:
+            conflicts_start = len(self._clauses)
+            slot_keys = self._field_keys(_TIME_SLOT, time_slots)
             # Conflict: teacher cannot be in two places at the same time
-            for teacher_id in teachers:
-                for time_slot_id in time_slots:
-                    teacher_time_vars = [
-                        var
-                        for (
-                            l_id,
-                            t_id,
-                            cg_id,
-                            r_id,
-                            ts_id,
-                        ), var in self.variables.items()
-                        if t_id == teacher_id and ts_id == time_slot_id
-                    ]
-                    for i in range(len(teacher_time_vars)):
-                        for j in range(i + 1, len(teacher_time_vars)):
-                            self.cnf.append(
-                                [-teacher_time_vars[i], -teacher_time_vars[j]]
-                            )
+            teacher_buckets = [
+                self._by_ts_teacher.get(teacher_key | slot_key, ())
+                for teacher_key in self._field_keys(_TEACHER, teachers)
+                for slot_key in slot_keys
+            ]
             # Conflict: same class/group cannot have two lessons at the same time (per group_id)
-            all_groups = class_groups + study_groups
-            for group_id in all_groups:
-                for time_slot_id in time_slots:
-                    group_time_vars = [
-                        var
-                        for (
-                            l_id,
-                            t_id,
-                            g_id,
-                            r_id,
-                            ts_id,
-                        ), var in self.variables.items()
-                        if g_id == group_id and ts_id == time_slot_id
-                    ]
-                    for i in range(len(group_time_vars)):
-                        for j in range(i + 1, len(group_time_vars)):
-                            self.cnf.append([-group_time_vars[i], -group_time_vars[j]])
-            # Conflict: student set must not overlap (class vs study for same student)
-            for student_id, memberships in student_group_memberships.items():
-                class_group_id = memberships.get("class_group_id")
-                study_group_ids = memberships.get("study_group_ids", [])
-                if class_group_id and study_group_ids:
-                    for study_group_id in study_group_ids:
-                        for time_slot_id in time_slots:
-                            class_vars = [
-                                var
-                                for (
-                                    l_id,
-                                    t_id,
-                                    g_id,
-                                    r_id,
-                                    ts_id,
-                                ), var in self.variables.items()
-                                if g_id == class_group_id and ts_id == time_slot_id
-                            ]
-                            study_vars = [
-                                var
-                                for (
-                                    l_id,
-                                    t_id,
-                                    g_id,
-                                    r_id,
-                                    ts_id,
-                                ), var in self.variables.items()
-                                if g_id == study_group_id and ts_id == time_slot_id
-                            ]
-                            for class_var in class_vars:
-                                for study_var in study_vars:
-                                    self.cnf.append([-class_var, -study_var])
-            # Conflict: two study groups with overlapping students cannot run in the same slot
-            overlapping_sg_pairs: Set[Tuple[UUID, UUID]] = set()
-            for memberships in student_group_memberships.values():
-                sgs = memberships.get("study_group_ids", [])
-                for i in range(len(sgs)):
-                    for j in range(i + 1, len(sgs)):
-                        a, b = sgs[i], sgs[j]
-                        if a != b:
-                            overlapping_sg_pairs.add((min(a, b), max(a, b)))
-            for sg_a, sg_b in overlapping_sg_pairs:
-                for time_slot_id in time_slots:
-                    a_vars = [
-                        var
-                        for (
-                            l_id,
-                            t_id,
-                            g_id,
-                            r_id,
-                            ts_id,
-                        ), var in self.variables.items()
-                        if g_id == sg_a and ts_id == time_slot_id
-                    ]
-                    b_vars = [
-                        var
-                        for (
-                            l_id,
-                            t_id,
-                            g_id,
-                            r_id,
-                            ts_id,
-                        ), var in self.variables.items()
-                        if g_id == sg_b and ts_id == time_slot_id
-                    ]
-                    for av in a_vars:
-                        for bv in b_vars:
-                            self.cnf.append([-av, -bv])
+            group_buckets = [
+                self._by_ts_group.get(group_key | slot_key, ())
+                for group_key in self._field_keys(_GROUP, class_groups + study_groups)
+                for slot_key in slot_keys
+            ]
             # Conflict: room cannot be used by two lessons at the same time
-            for room_id in rooms:
+            room_buckets = [
+                self._by_ts_room.get(room_key | slot_key, ())
+                for room_key in self._field_keys(_ROOM, rooms)
+                for slot_key in slot_keys
+            ]
+            for buckets in (teacher_buckets, group_buckets, room_buckets):
+                for lits in buckets:
+                    self._amo(lits)
+            # Conflict: student set must not overlap (class vs study for same student,
+            # and two study groups sharing a student). Students with the same
+            # memberships share a profile, so pairs are derived once per profile.
+            profiles = {
+                (
+                    memberships.get("class_group_id"),
+                    frozenset(memberships.get("study_group_ids", ())),
+                )
+                for memberships in student_group_memberships.values()
+            }
+            # Every group of a profile excludes every other one, so profiles larger
+            # than the pairwise threshold become one at-most-one per time slot over
+            # the groups' busy literals instead of all of their pairs.
+            pairwise_max = self._amo_pairwise_max()
+            overlapping_pairs: Set[Tuple[UUID, UUID]] = set()
+            overlapping_cliques: Set[Tuple[UUID, ...]] = set()
+            for class_group_id, study_group_ids in profiles:
+                if not study_group_ids:
+                    continue
+                group_ids = sorted(study_group_ids)
+                if class_group_id:
+                    group_ids.insert(0, class_group_id)
+                if len(group_ids) > pairwise_max:
+                    overlapping_cliques.add(tuple(group_ids))
+                else:
+                    overlapping_pairs.update(combinations(group_ids, 2))
+            for group_a, group_b in overlapping_pairs:
                 for time_slot_id in time_slots:
-                    room_time_vars = [
-                        var
-                        for (
-                            l_id,
-                            t_id,
-                            cg_id,
-                            r_id,
-                            ts_id,
-                        ), var in self.variables.items()
-                        if r_id == room_id and ts_id == time_slot_id
-                    ]
-                    for i in range(len(room_time_vars)):
-                        for j in range(i + 1, len(room_time_vars)):
-                            self.cnf.append([-room_time_vars[i], -room_time_vars[j]])
-        for (l_id, t_id, g_id, r_id, ts_id), var in self.variables.items():
-            room_capacity = room_capacities.get(r_id, 0)
-            group_type = self.group_types.get(g_id, "class_group")
-            if group_type == "class_group":
-                group_size = class_group_sizes.get(g_id, 0)
-            else:
-                group_size = study_group_sizes.get(g_id, 0)
-            if group_size > room_capacity:
-                self.cnf.append([-var])
+                    busy_a = self._busy_var(group_a, time_slot_id)
+                    if busy_a is None:
+                        continue
+                    busy_b = self._busy_var(group_b, time_slot_id)
+                    if busy_b is None:
+                        continue
+                    self._clauses.append([-busy_a, -busy_b])
+            for group_ids in overlapping_cliques:
+                for time_slot_id in time_slots:
+                    busy = [self._busy_var(g, time_slot_id) for g in group_ids]
+                    self._amo([b for b in busy if b is not None])
+            self._conflict_spans.append((conflicts_start, len(self._clauses)))
+
+    def _busy_var(self, group_id: UUID, time_slot_id: UUID) -> Optional[int]:
+        """
+        Returns a literal that is true whenever the group has a lesson in the slot,
+        or None if the group has no variables there.
+
+        A fresh variable B is allocated on first use with clauses v -> B for every
+        lesson variable v; the reverse direction is not needed for mutual exclusion.
+        Single-variable buckets reuse that variable directly.
+        """
+        group_key = self._axis_keys[_GROUP].get(group_id)
+        slot_key = self._axis_keys[_TIME_SLOT].get(time_slot_id)
+        if group_key is None or slot_key is None:
+            return None
+        key = group_key | slot_key
+        busy = self._busy_vars.get(key)
+        if busy is not None:
+            return busy
+        group_vars = self._by_ts_group.get(key, ())
+        if not group_vars:
+            return None
+        if len(group_vars) == 1:
+            busy = group_vars[0]
+        else:
+            busy = self.next_var
+            self.next_var += 1
+            self._clauses.extend([[-v, busy] for v in group_vars])
+        self._busy_vars[key] = busy
+        return busy
+
+    def _amo_pairwise_max(self) -> int:
+        """Largest bucket size that is encoded pairwise."""
+        if self.use_sequential_amo:
+            return self.PAIRWISE_AMO_MAX
+        return sys.maxsize
+
+    def _amo(self, lits: List[int]) -> None:
+        """Requires at most one of ``lits`` to be true."""
+        pairwise_max = self._amo_pairwise_max()
+        self._clauses.extend(_amo_clauses(lits, self.next_var, pairwise_max))
+        self.next_var += _amo_aux_count(len(lits), pairwise_max)
+
+    def _encode_exactly(self, lits: List[int], count: int) -> None:
+        """
+        Requires exactly ``count`` of ``lits`` to be true.
+
+        The common ``count == 1`` case is emitted as a single at-least-one clause
+        plus a bitwise at-most-one, which is smaller and propagates faster than
+        the sequential counter used for larger bounds.
+        """
+        if count == 1:
+            self._clauses.append(list(lits))
+            card_cnf = CardEnc.atmost(
+                lits=lits,
+                bound=1,
+                top_id=self.next_var - 1,
+                encoding=EncType.bitwise,
+            )
+        else:
+            card_cnf = CardEnc.equals(
+                lits=lits,
+                bound=count,
+                top_id=self.next_var - 1,
+                encoding=EncType.seqcounter,
+            )
+        self._clauses.extend(card_cnf.clauses)
+        self.next_var = max(self.next_var, card_cnf.nv + 1)
 
     def encode_soft_constraints(
         self,
@@ -381,10 +752,12 @@ class ScheduleEncoder:
             for lesson_id, teacher_id, class_id, room_id, time_slot_id in preferences[
                 "teacher_preferences"
             ]:
-                key = (lesson_id, teacher_id, class_id, room_id, time_slot_id)
-                if key in self.variables:
-                    var = self.variables[key]
-                    self.cnf.append([var])
+                key = self._pack_key(
+                    (lesson_id, teacher_id, class_id, room_id, time_slot_id)
+                )
+                var = self.variables.get(key)
+                if var is not None:
+                    self._clauses.append([var])
 
     def encode_custom_constraints(self, constraints: List[Dict]) -> None:
         """
@@ -393,6 +766,7 @@ class ScheduleEncoder:
         Args:
             constraints: List of constraints with fields constraint_type and constraint_data
         """
+        negated: List[int] = []
         for constraint in constraints:
             constraint_type = constraint.get("constraint_type")
             constraint_data = constraint.get("constraint_data", {})
@@ -401,38 +775,26 @@ class ScheduleEncoder:
             if constraint_type == "teacher_unavailable":
                 teacher_id = constraint_data.get("teacher_id")
                 unavailable_time_slots = constraint_data.get("time_slot_ids", [])
-                for time_slot_id in unavailable_time_slots:
-                    teacher_time_vars = [
-                        var
-                        for (
-                            l_id,
-                            t_id,
-                            cg_id,
-                            r_id,
-                            ts_id,
-                        ), var in self.variables.items()
-                        if t_id == teacher_id and ts_id == time_slot_id
-                    ]
-                    for var in teacher_time_vars:
-                        self.cnf.append([-var])
+                negated.extend(
+                    -var
+                    for time_slot_id in unavailable_time_slots
+                    for var in self._bucket(
+                        self._by_ts_teacher,
+                        (_TEACHER, teacher_id),
+                        (_TIME_SLOT, time_slot_id),
+                    )
+                )
 
             elif constraint_type == "room_unavailable":
                 room_id = constraint_data.get("room_id")
                 unavailable_time_slots = constraint_data.get("time_slot_ids", [])
-                for time_slot_id in unavailable_time_slots:
-                    room_time_vars = [
-                        var
-                        for (
-                            l_id,
-                            t_id,
-                            cg_id,
-                            r_id,
-                            ts_id,
-                        ), var in self.variables.items()
-                        if r_id == room_id and ts_id == time_slot_id
-                    ]
-                    for var in room_time_vars:
-                        self.cnf.append([-var])
+                negated.extend(
+                    -var
+                    for time_slot_id in unavailable_time_slots
+                    for var in self._bucket(
+                        self._by_ts_room, (_ROOM, room_id), (_TIME_SLOT, time_slot_id)
+                    )
+                )
 
             elif constraint_type == "class_preference":
                 class_group_id = constraint_data.get("class_group_id")
@@ -449,14 +811,162 @@ class ScheduleEncoder:
             elif constraint_type == "consecutive_preference":
                 pass
 
+        self._clauses.extend([lit] for lit in negated)
+
+    def encode_room_symmetry_breaking(
+        self,
+        rooms: List[UUID],
+        time_slots: List[UUID],
+        room_capacities: Dict[UUID, int],
+        constraints: List[Dict],
+    ) -> None:
+        """
+        Breaks room symmetry: within a time slot, rooms of equal capacity that are
+        both available are interchangeable, so only solutions that fill them in
+        ``rooms`` order are kept (if room i+1 is used in the slot, room i is too).
+
+        Sound only while no clause refers to a particular room beyond capacity and
+        room_unavailable constraints (which are read from ``constraints``); do not
+        combine with teacher_preferences.
+        """
+        room_unavailability = unavailable_slots(constraints)[1]
+        for time_slot_id in time_slots:
+            classes: Dict[int, List[UUID]] = defaultdict(list)
+            for room_id in rooms:
+                if time_slot_id not in room_unavailability.get(room_id, ()):
+                    classes[room_capacities.get(room_id, 0)].append(room_id)
+            self._order_used(
+                [
+                    self._bucket(
+                        self._by_ts_room, (_ROOM, room_id), (_TIME_SLOT, time_slot_id)
+                    )
+                    for room_id in ids
+                ]
+                for ids in classes.values()
+            )
+
+    def encode_teacher_symmetry_breaking(
+        self,
+        teachers: List[int],
+        time_slots: List[UUID],
+        teacher_lessons: Dict[int, Set[UUID]],
+        constraints: List[Dict],
+    ) -> None:
+        """
+        Breaks teacher symmetry: within a time slot, teachers with the same set of
+        lessons that are both available are interchangeable, so only solutions
+        that fill them in ``teachers`` order are kept.
+
+        Sound only while no clause refers to a particular teacher beyond
+        teacher_lessons and teacher_unavailable constraints; do not combine with
+        teacher_preferences.
+        """
+        teacher_unavailability = unavailable_slots(constraints)[0]
+        lesson_sets = {t: frozenset(teacher_lessons.get(t, ())) for t in teachers}
+        for time_slot_id in time_slots:
+            classes: Dict[FrozenSet[UUID], List[int]] = defaultdict(list)
+            for teacher_id, lessons in lesson_sets.items():
+                if lessons and time_slot_id not in teacher_unavailability.get(
+                    teacher_id, ()
+                ):
+                    classes[lessons].append(teacher_id)
+            self._order_used(
+                [
+                    self._bucket(
+                        self._by_ts_teacher,
+                        (_TEACHER, teacher_id),
+                        (_TIME_SLOT, time_slot_id),
+                    )
+                    for teacher_id in ids
+                ]
+                for ids in classes.values()
+            )
+
+    def _order_used(self, classes: Iterable[List[Sequence[int]]]) -> None:
+        """
+        For each class of interchangeable resources (given by their variable
+        buckets in one time slot), requires resource i to be used whenever
+        resource i+1 is. Classes of a single resource are skipped.
+        """
+        for buckets in classes:
+            if len(buckets) < 2:
+                continue
+            previous_used: Optional[int] = None
+            for bucket in buckets:
+                used = self._used_var(bucket)
+                if previous_used is not None:
+                    self._clauses.append([-used, previous_used])
+                previous_used = used
+
+    def _used_var(self, bucket: Sequence[int]) -> int:
+        """Allocates U with U <-> (some variable of ``bucket`` is true)."""
+        used = self.next_var
+        self.next_var += 1
+        self._clauses.extend([-v, used] for v in bucket)
+        self._clauses.append([-used, *bucket])
+        return used
+
+    def get_clauses(self, include_conflicts: bool = True) -> List[List[int]]:
+        """
+        Returns the accumulated clause list (not a copy), or with
+        ``include_conflicts=False`` a new list without the conflict constraints.
+        """
+        if include_conflicts or not self._conflict_spans:
+            return self._clauses
+        clauses: List[List[int]] = []
+        start = 0
+        for span_start, span_end in self._conflict_spans:
+            clauses.extend(self._clauses[start:span_start])
+            start = span_end
+        clauses.extend(self._clauses[start:])
+        return clauses
+
+    def without_conflicts(self) -> "ScheduleEncoder":
+        """
+        Returns a shallow copy whose clauses omit the conflict constraints
+        (teacher, group, room and student overlap), for UNSAT diagnostics.
+        """
+        relaxed = copy.copy(self)
+        relaxed._clauses = self.get_clauses(include_conflicts=False)
+        relaxed._conflict_spans = []
+        return relaxed
+
     def get_cnf(self) -> CNF:
-        """Returns CNF formula."""
-        return self.cnf
+        """Returns CNF formula built from the accumulated clauses."""
+        cnf = CNF()
+        cnf.clauses = self._clauses
+        cnf.nv = self.next_var - 1
+        return cnf
 
     def get_variable_mapping(self) -> Dict[Tuple[UUID, int, UUID, UUID, UUID], int]:
         """Returns mapping of combinations to variables."""
-        return self.variables.copy()
+        return {self._unpack_key(key): var for key, var in self.variables.items()}
 
     def get_reverse_mapping(self) -> Dict[int, Tuple[UUID, int, UUID, UUID, UUID]]:
         """Returns reverse mapping of variables to combinations."""
-        return self.reverse_variables.copy()
+        return {
+            var: self._unpack_key(key)
+            for var, key in enumerate(self.reverse_variables, start=1)
+        }
+
+    def decode_variable(self, var: int) -> Optional[Tuple[UUID, int, UUID, UUID, UUID]]:
+        """Returns the combination for a variable, or None for auxiliary variables."""
+        if 0 < var <= len(self.reverse_variables):
+            return self._unpack_key(self.reverse_variables[var - 1])
+        return None
+
+    def decode_model(
+        self, model: List[int]
+    ) -> List[Tuple[UUID, int, UUID, UUID, UUID]]:
+        """
+        Returns the combinations whose variables are true in a solver model.
+
+        pysat models list variables 1..n in order, so the combination variables are
+        the first len(reverse_variables) literals; other orderings are filtered.
+        """
+        keys = self.reverse_variables
+        n = len(keys)
+        unpack = self._unpack_key
+        if len(model) >= n and (n == 0 or abs(model[n - 1]) == n):
+            return [unpack(keys[lit - 1]) for lit in model[:n] if lit > 0]
+        return [unpack(keys[lit - 1]) for lit in model if 0 < lit <= n]
@@ -2,7 +2,8 @@
 Module for solving SAT problem and extracting schedule.
 """
 
-from typing import Dict, List, Optional, Tuple
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
 from uuid import UUID
 
 from pysat.solvers import Solver
@@ -10,33 +11,92 @@ from pysat.solvers import Solver
 from app.scheduler.sat_encoder import ScheduleEncoder
 
 
+def _interrupt(solver: Solver) -> None:
+    """Stops a running solve_limited call, if the backend supports it."""
+    try:
+        solver.interrupt()
+    except NotImplementedError:
+        # CaDiCaL cannot be interrupted and keeps solving past the timeout.
+        pass
+
+
 class ScheduleSolver:
     """
     Class for solving SAT problem and extracting schedule from solution.
     """
 
+    __slots__ = ("encoder", "solver", "_solver_name", "_pushed_clauses")
+
     def __init__(self, encoder: ScheduleEncoder):
         self.encoder = encoder
         self.solver: Optional[Solver] = None
-
-    def solve(self, timeout: int = 300) -> bool:
+        self._solver_name: Optional[str] = None
+        # Number of encoder clauses already loaded into self.solver.
+        self._pushed_clauses = 0
+
+    def solve(
+        self,
+        timeout: int = 300,
+        solver_name: str = "cadical153",
+        conf_budget: Optional[int] = None,
+        assumptions: Sequence[int] = (),
+    ) -> Optional[bool]:
         """
         Solves SAT problem.
 
+        The solver instance is kept between calls: a repeated call only loads the
+        clauses the encoder gained since the previous one, so learned clauses are
+        reused. Changing ``solver_name`` starts a fresh solver.
+
         Args:
-            timeout: Maximum solving time in seconds
+            timeout: Maximum solving time in seconds; enforced by interrupting the
+                backend, which not every backend supports. CaDiCaL does not, so
+                a hard deadline needs the solve to run in a process that can be
+                killed (see schedule_generator._call_in_process)
+            solver_name: pysat solver backend (e.g. "cadical153", "glucose4")
+            conf_budget: Optional conflict limit for this call; solving stops
+                once it is spent
+            assumptions: Literals assumed true for this call only
 
         Returns:
-            True if solution found, False otherwise
+            True if solution found, False if unsatisfiable,
+            None if the timeout or the conflict budget ran out first
         """
-        cnf = self.encoder.get_cnf()
-        self.solver = Solver(name="glucose3", bootstrap_with=cnf)
+        if self.solver is None or self._solver_name != solver_name:
+            self.close()
+            self.solver = Solver(name=solver_name)
+            self._solver_name = solver_name
+
+        clauses = self.encoder.get_clauses()
+        if self._pushed_clauses < len(clauses):
+            self.solver.append_formula(clauses[self._pushed_clauses :], no_return=True)
+            self._pushed_clauses = len(clauses)
+
+        # The backend keeps a budget across calls, so None has to lift an
+        # earlier one (-1 means unlimited).
+        self.solver.conf_budget(-1 if conf_budget is None else conf_budget)
+        timer = threading.Timer(timeout, _interrupt, (self.solver,))
+        timer.start()
         try:
-            self.solver.set_timeout(timeout)
-        except AttributeError:
-            pass
+            result = self.solver.solve_limited(
+                assumptions=assumptions, expect_interrupt=True
+            )
+        finally:
+            timer.cancel()
+        if result is None:
+            try:
+                self.solver.clear_interrupt()
+            except NotImplementedError:
+                pass
+        return result
+
+    def add_assumption(self, var: int, value: bool, **kwargs) -> Optional[bool]:
+        """
+        Checks satisfiability with ``var`` fixed to ``value`` for this call only.
 
-        return self.solver.solve()
+        Takes the same keyword arguments as solve().
+        """
+        return self.solve(assumptions=[var if value else -var], **kwargs)
 
     def extract_schedule(self) -> List[Tuple[UUID, int, UUID, UUID, UUID]]:
         """
@@ -53,14 +113,7 @@ class ScheduleSolver:
         if not model:
             return []
 
-        reverse_mapping = self.encoder.get_reverse_mapping()
-        schedule = []
-
-        for var in model:
-            if var > 0 and var in reverse_mapping:
-                schedule.append(reverse_mapping[var])
-
-        return schedule
+        return self.encoder.decode_model(model)
 
     def optimize(self) -> List[Tuple[UUID, int, UUID, UUID, UUID]]:
         """
@@ -81,6 +134,8 @@ class ScheduleSolver:
         if self.solver:
             self.solver.delete()
             self.solver = None
+        self._solver_name = None
+        self._pushed_clauses = 0
 
     def __enter__(self):
         """Context manager entry."""
@@ -2,39 +2,322 @@
 Main class for schedule generation.
 """
 
+import asyncio
 import json
 import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
 from uuid import UUID
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.cache import RedisCache
+from app.core.config import settings
 from app.scheduler.constraint_builder import ConstraintBuilder
-from app.scheduler.sat_encoder import ScheduleEncoder
+from app.scheduler.sat_encoder import (
+    ScheduleEncoder,
+    fingerprint,
+    unavailable_slots,
+)
 from app.scheduler.sat_solver import ScheduleSolver
 
 logger = logging.getLogger(__name__)
 
 
-def _serialize_for_debug_log(obj: Any) -> Any:
-    """Convert input data to JSON-serializable form for debug logging."""
-    if obj is None:
-        return None
-    if isinstance(obj, UUID):
-        return str(obj)
-    if isinstance(obj, (int, float, str, bool)):
-        return obj
-    if isinstance(obj, set):
-        return [_serialize_for_debug_log(x) for x in obj]
-    if isinstance(obj, list):
-        return [_serialize_for_debug_log(x) for x in obj]
-    if isinstance(obj, dict):
-        return {
-            (str(k) if isinstance(k, UUID) else k): _serialize_for_debug_log(v)
-            for k, v in obj.items()
-        }
-    return str(obj)
+_UNSAT_ERROR = "No solution: the constraints cannot all be satisfied."
+# Backend of the UNSAT diagnostic; unlike CaDiCaL it stops at its timeout.
+_DIAGNOSE_SOLVER = "glucose4"
+_TIMEOUT_ERROR = (
+    "No solution found within {timeout} s. Try increasing the timeout or "
+    "relaxing constraints."
+)
+
+
+class ScheduleRow(NamedTuple):
+    """One generated schedule entry."""
+
+    lesson_id: UUID
+    teacher_id: int
+    class_group_id: Optional[UUID]
+    study_group_id: Optional[UUID]
+    room_id: UUID
+    time_slot_id: UUID
+
+
+# Positions of the UUID-valued fields of ScheduleRow.
+_ROW_UUID_FIELDS = tuple(
+    i for i, name in enumerate(ScheduleRow._fields) if name != "teacher_id"
+)
+
+
+def _dump_entries(entries: List[ScheduleRow]) -> bytes:
+    """Serializes schedule entries for the result cache."""
+    return json.dumps(entries, default=str).encode()
+
+
+def _load_entries(raw: bytes) -> List[ScheduleRow]:
+    """Inverse of _dump_entries."""
+    entries = []
+    for fields in json.loads(raw):
+        for i in _ROW_UUID_FIELDS:
+            if fields[i] is not None:
+                fields[i] = UUID(fields[i])
+        entries.append(ScheduleRow(*fields))
+    return entries
+
+
+# fingerprint(data) -> validate_input result, least recently used first.
+VALIDATION_CACHE_MAX = 32
+_validation_cache: "OrderedDict[str, Tuple[bool, Optional[str]]]" = OrderedDict()
+
+# fingerprint(data) -> "Infeasible: ..." error, least recently used first.
+INFEASIBLE_CACHE_MAX = 32
+_infeasible_cache: "OrderedDict[str, str]" = OrderedDict()
+
+
+# Every solve runs in a process of its own that is killed at its deadline:
+# pysat holds the GIL while solving and CaDiCaL ignores interrupts, so a
+# solve cannot be stopped in a thread or a reused pool worker. Processes fork
+# from a server that has already imported this module, so starting one takes
+# milliseconds rather than a fresh interpreter's import time.
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _solver_context = multiprocessing.get_context("forkserver")
+    _solver_context.set_forkserver_preload([__name__])
+else:
+    _solver_context = multiprocessing.get_context("spawn")
+# At most one solver process per CPU; further solves wait within their deadline.
+_solver_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+_solver_processes: Set[BaseProcess] = set()
+# How often a waiting solve checks its deadline and cancellation.
+_SOLVER_POLL_SECONDS = 0.05
+
+
+def stop_solver_processes() -> None:
+    """Kills the solver processes that are still running, e.g. on shutdown."""
+    for process in list(_solver_processes):
+        process.kill()
+
+
+def _solver_process_main(conn: Connection, func: Callable, args: tuple) -> None:
+    """Solver process entry point: sends back (True, result) or (False, error)."""
+    try:
+        message = (True, func(*args))
+    except Exception as e:
+        message = (False, e)
+    with conn:
+        conn.send(message)
+
+
+def _run_in_process(
+    func: Callable, args: tuple, timeout: float, cancelled: threading.Event
+) -> Tuple[bool, Any]:
+    """
+    Runs ``func(*args)`` in a new solver process (blocking; run in a thread).
+
+    The process is killed once ``timeout`` seconds have passed, counting the
+    wait for a free slot, or as soon as ``cancelled`` is set. Exceptions raised
+    by ``func`` are re-raised.
+
+    Returns:
+        (True, result) if ``func`` returned in time, otherwise (False, None)
+    """
+    deadline = time.monotonic() + timeout
+
+    def expired() -> bool:
+        return cancelled.is_set() or time.monotonic() >= deadline
+
+    while not _solver_slots.acquire(timeout=_SOLVER_POLL_SECONDS):
+        if expired():
+            return False, None
+    try:
+        receiver, sender = _solver_context.Pipe(duplex=False)
+        process = _solver_context.Process(
+            target=_solver_process_main, args=(sender, func, args), daemon=True
+        )
+        process.start()
+        sender.close()
+        _solver_processes.add(process)
+        try:
+            while not receiver.poll(_SOLVER_POLL_SECONDS):
+                if expired():
+                    return False, None
+            try:
+                ok, result = receiver.recv()
+            except EOFError:
+                raise RuntimeError("Solver process exited without a result") from None
+        finally:
+            if process.is_alive():
+                process.kill()
+            process.join()
+            receiver.close()
+            _solver_processes.discard(process)
+    finally:
+        _solver_slots.release()
+    if not ok:
+        raise result
+    return True, result
+
+
+async def _call_in_process(func: Callable, *args, timeout: float) -> Tuple[bool, Any]:
+    """Awaitable _run_in_process; cancelling the call kills the process."""
+    cancelled = threading.Event()
+    try:
+        return await asyncio.to_thread(_run_in_process, func, args, timeout, cancelled)
+    finally:
+        cancelled.set()
+
+
+def _missing_data_error(present: Dict[str, Any]) -> Optional[str]:
+    """Error for the first required kind of entity the institution lacks, if any."""
+    if not present["lessons"]:
+        return "No lessons found for this institution"
+    if not present["teachers"]:
+        return "No teachers found for this institution"
+    if not present["class_groups"] and not present.get("study_groups"):
+        return "No class groups or study groups found for this institution"
+    if not present["rooms"]:
+        return "No rooms found for this institution"
+    if not present["time_slots"]:
+        return "No time slots found for this institution"
+    return None
+
+
+def _check_input_data(data: Dict) -> Tuple[bool, Optional[str]]:
+    """Validation checks of validate_input that only depend on the built data."""
+    error = _missing_data_error(data)
+    if error:
+        return False, error
+    teachers_with_lessons = {
+        t_id for t_id, lessons in data["teacher_lessons"].items() if lessons
+    }
+    if not teachers_with_lessons:
+        return False, "No teachers have assigned lessons"
+
+    class_group_lessons = data.get("class_group_lessons", {})
+    study_group_lessons = data.get("study_group_lessons", {})
+    taught = set().union(
+        *(data["teacher_lessons"][tid] for tid in teachers_with_lessons)
+    )
+    # One pass over the groups, stopping as soon as both a non-empty assignment
+    # and a teachable lesson have been seen. Teachability is a single
+    # set-disjointness test per group rather than a lookup per lesson.
+    has_slots = at_least_one_teachable = False
+    for lessons_dict in chain(
+        class_group_lessons.values(), study_group_lessons.values()
+    ):
+        if not has_slots:
+            has_slots = any(count > 0 for count in lessons_dict.values())
+        if not at_least_one_teachable:
+            at_least_one_teachable = not taught.isdisjoint(lessons_dict)
+        if has_slots and at_least_one_teachable:
+            break
+    if not has_slots:
+        return (
+            False,
+            "No lesson–group assignments. Assign lessons to class groups and/or "
+            "study groups in the Group Lessons tab.",
+        )
+    if not at_least_one_teachable:
+        return (
+            False,
+            "No lesson–group assignments with an assigned teacher. Assign lessons to "
+            "class groups and/or study groups in the Group Lessons tab, and ensure "
+            "those lessons are assigned to at least one teacher.",
+        )
+
+    # Multiple (lesson, group) pairs can share a time slot when there is no
+    # resource conflict (different teacher, room, no student overlap).
+    # So we only require at least one time slot; "No time slots" is checked above.
+    # We do not require time_slots >= total_pairs.
+
+    return True, None
+
+
+def _encode(
+    data: Dict, cache_dir: Optional[Path]
+) -> Tuple[ScheduleEncoder, Optional[str]]:
+    """
+    Encodes institution data (blocking; runs in a solver process).
+
+    Returns:
+        (encoder, error): error is an "Infeasible: ..." message when some
+        (lesson, group) pair cannot be placed at all, in which case the hard
+        constraints are not encoded
+    """
+    encoder = ScheduleEncoder(
+        cache_dir=cache_dir, cache_max_entries=settings.SCHEDULER_CACHE_MAX_ENTRIES
+    )
+    lessons = data["lessons"]
+    teachers = data["teachers"]
+    class_groups = data["class_groups"]
+    study_groups = data.get("study_groups", [])
+    rooms = data["rooms"]
+    time_slots = data["time_slots"]
+    teacher_lessons = data["teacher_lessons"]
+    room_capacities = data["room_capacities"]
+    constraints = data["constraints"]
+    class_group_lessons = data.get("class_group_lessons", {})
+    study_group_lessons = data.get("study_group_lessons", {})
+    # Unavailable (teacher | room, time slot) combinations get no variables.
+    teacher_unavailability, room_unavailability = unavailable_slots(constraints)
+    encoder.encode_variables(
+        lessons=lessons,
+        teachers=teachers,
+        class_groups=class_groups,
+        study_groups=study_groups,
+        rooms=rooms,
+        time_slots=time_slots,
+        teacher_lessons=teacher_lessons,
+        class_group_lessons=class_group_lessons,
+        study_group_lessons=study_group_lessons,
+        room_capacities=room_capacities,
+        class_group_sizes=data["class_group_sizes"],
+        study_group_sizes=data.get("study_group_sizes", {}),
+        teacher_unavailability=teacher_unavailability,
+        room_unavailability=room_unavailability,
+    )
+    infeasible = encoder.get_infeasible_pairs(
+        class_group_lessons=class_group_lessons,
+        study_group_lessons=study_group_lessons,
+    )
+    if infeasible:
+        parts = [f"lesson {l} group {g}: {r}" for l, g, r in infeasible]
+        return encoder, "Infeasible: " + "; ".join(parts)
+    encoder.encode_hard_constraints(
+        lessons=lessons,
+        class_groups=class_groups,
+        study_groups=study_groups,
+        teachers=teachers,
+        rooms=rooms,
+        time_slots=time_slots,
+        student_group_memberships=data.get("student_group_memberships", {}),
+        class_group_lessons=class_group_lessons,
+        study_group_lessons=study_group_lessons,
+    )
+    encoder.encode_custom_constraints(constraints)
+    if settings.SCHEDULER_ROOM_SYMMETRY_BREAKING:
+        encoder.encode_room_symmetry_breaking(
+            rooms=rooms,
+            time_slots=time_slots,
+            room_capacities=room_capacities,
+            constraints=constraints,
+        )
+    if settings.SCHEDULER_TEACHER_SYMMETRY_BREAKING:
+        encoder.encode_teacher_symmetry_breaking(
+            teachers=teachers,
+            time_slots=time_slots,
+            teacher_lessons=teacher_lessons,
+            constraints=constraints,
+        )
+    return encoder, None
 
 
 class ScheduleGenerator:
@@ -42,247 +325,293 @@ class ScheduleGenerator:
     Main class for schedule generation using SAT solver.
     """
 
-    def __init__(self, db: AsyncSession):
+    # Bump when the encoding changes in a way that could change the produced schedule.
+    RESULT_CACHE_PREFIX = "schedule:result:v2:"
+
+    def __init__(self, db: AsyncSession, cache: Optional[RedisCache] = None):
+        """
+        Args:
+            db: Database session
+            cache: Redis cache for generated schedules keyed by a fingerprint of the
+                institution data; results are not cached when None
+        """
         self.db = db
+        self.cache = cache
         self.constraint_builder = ConstraintBuilder(db)
+        self.cache_dir = (
+            Path(settings.SCHEDULER_CACHE_DIR) if settings.SCHEDULER_CACHE_DIR else None
+        )
+        # institution_id -> build_from_institution result, for this generator's lifetime
+        self._build_cache: Dict[UUID, Dict] = {}
 
-    async def validate_input(self, institution_id: UUID) -> tuple[bool, Optional[str]]:
+    async def _cached_build(self, institution_id: UUID) -> Dict:
+        """Returns build_from_institution data, loading it at most once per institution."""
+        data = self._build_cache.get(institution_id)
+        if data is None:
+            data = await self.constraint_builder.build_from_institution(institution_id)
+            self._build_cache[institution_id] = data
+        return data
+
+    async def validate_input(
+        self,
+        institution_id: UUID,
+        data: Optional[Dict] = None,
+        data_key: Optional[str] = None,
+    ) -> tuple[bool, Optional[str]]:
         """
         Validates input data before schedule generation.
 
         Args:
             institution_id: Institution ID
+            data: Already built institution data; when omitted it is loaded after a
+                single-query existence probe
+            data_key: fingerprint(data); when given, the result is remembered and
+                reused for identical data
 
         Returns:
             (is_valid, error_message)
         """
-        data = await self.constraint_builder.build_from_institution(institution_id)
-        if not data["lessons"]:
-            return False, "No lessons found for this institution"
-        if not data["teachers"]:
-            return False, "No teachers found for this institution"
-        if not data["class_groups"] and not data.get("study_groups"):
-            return False, "No class groups or study groups found for this institution"
-        if not data["rooms"]:
-            return False, "No rooms found for this institution"
-        if not data["time_slots"]:
-            return False, "No time slots found for this institution"
-        teachers_with_lessons = {
-            t_id for t_id, lessons in data["teacher_lessons"].items() if lessons
-        }
-        if not teachers_with_lessons:
-            return False, "No teachers have assigned lessons"
-
-        class_group_lessons = data.get("class_group_lessons", {})
-        study_group_lessons = data.get("study_group_lessons", {})
-        total_slots = sum(
-            c for d in class_group_lessons.values() for c in d.values()
-        ) + sum(c for d in study_group_lessons.values() for c in d.values())
-        if total_slots == 0:
-            return (
-                False,
-                "No lesson–group assignments. Assign lessons to class groups and/or "
-                "study groups in the Group Lessons tab.",
-            )
-        at_least_one_teachable = False
-        for cg_id, lessons_dict in class_group_lessons.items():
-            for lid in lessons_dict:
-                if any(
-                    lid in data["teacher_lessons"].get(tid, set())
-                    for tid in teachers_with_lessons
-                ):
-                    at_least_one_teachable = True
-                    break
-            if at_least_one_teachable:
-                break
-        if not at_least_one_teachable:
-            for sg_id, lessons_dict in study_group_lessons.items():
-                for lid in lessons_dict:
-                    if any(
-                        lid in data["teacher_lessons"].get(tid, set())
-                        for tid in teachers_with_lessons
-                    ):
-                        at_least_one_teachable = True
-                        break
-                if at_least_one_teachable:
-                    break
-        if not at_least_one_teachable:
-            return (
-                False,
-                "No lesson–group assignments with an assigned teacher. Assign lessons to "
-                "class groups and/or study groups in the Group Lessons tab, and ensure "
-                "those lessons are assigned to at least one teacher.",
+        if data is None and institution_id not in self._build_cache:
+            # Cheap existence probe first, so trivially incomplete institutions
+            # are rejected without loading everything.
+            error = _missing_data_error(
+                await self.constraint_builder.probe_institution(institution_id)
             )
-
-        # Multiple (lesson, group) pairs can share a time slot when there is no
-        # resource conflict (different teacher, room, no student overlap).
-        # So we only require at least one time slot; "No time slots" is checked above.
-        # We do not require time_slots >= total_pairs.
-
-        return True, None
+            if error:
+                return False, error
+        if data is None:
+            data = await self._cached_build(institution_id)
+        if data_key is None:
+            return _check_input_data(data)
+        result = _validation_cache.get(data_key)
+        if result is None:
+            result = _check_input_data(data)
+            _validation_cache[data_key] = result
+            if len(_validation_cache) > VALIDATION_CACHE_MAX:
+                _validation_cache.popitem(last=False)
+        else:
+            _validation_cache.move_to_end(data_key)
+        return result
 
     async def generate(
-        self, institution_id: UUID, timeout: int = 300
-    ) -> tuple[bool, Optional[List[Dict]], Optional[str]]:
+        self, institution_id: UUID, timeout: int = 300, diagnose: bool = True
+    ) -> tuple[bool, Optional[List[ScheduleRow]], Optional[str]]:
         """
         Generates schedule for an institution.
 
         Args:
             institution_id: Institution ID
             timeout: Maximum solving time in seconds
+            diagnose: On failure, re-solve the encoding without its conflict
+                constraints to explain why; when False a generic error is returned
+                without the extra solve
 
         Returns:
             (success, schedule_entries, error_message)
-            schedule_entries: List of dictionaries with fields:
-                {
-                    "lesson_id": UUID,
-                    "teacher_id": int,
-                    "class_group_id": UUID | None,
-                    "study_group_id": UUID | None,
-                    "room_id": UUID,
-                    "time_slot_id": UUID
-                }
+            schedule_entries: List of ScheduleRow tuples
         """
-        is_valid, error = await self.validate_input(institution_id)
+        data = await self._cached_build(institution_id)
+        # Canonicalizing a large institution takes a while; keep it off the loop.
+        data_key = await asyncio.to_thread(fingerprint, data)
+        is_valid, error = await self.validate_input(
+            institution_id, data=data, data_key=data_key
+        )
         if not is_valid:
             return False, None, error
-        data = await self.constraint_builder.build_from_institution(institution_id)
 
-        # --- ВРЕМЕННОЕ ЛОГИРОВАНИЕ: входные данные перед генерацией (удалить после отладки) ---
-        _debug_payload = {
-            "institution_id": str(institution_id),
-            "timeout": timeout,
-            "data": data,
+        result_key: Optional[str] = None
+        if self.cache is not None:
+            result_key = self.RESULT_CACHE_PREFIX + data_key
+            try:
+                cached = await self.cache.get(result_key)
+            except Exception as e:
+                logger.warning("Could not read schedule result cache: %s", e)
+                cached = None
+            if cached is not None:
+                return True, _load_entries(cached), None
+
+        # A retry with unchanged data would be proven infeasible again.
+        error = _infeasible_cache.get(data_key)
+        if error is not None:
+            _infeasible_cache.move_to_end(data_key)
+            return False, None, error
+
+        # The diagnostic solves a relaxation, so it gets at most a fraction of
+        # the budget (and only what the main solve left over).
+        diagnose_timeout = max(1, timeout // 4) if diagnose else None
+        # pysat holds the GIL while solving, so encoding and solving run in a
+        # worker process to keep the event loop (and other requests) responsive.
+        status, result = await self._solve_portfolio(data, timeout, diagnose_timeout)
+        if status is None:
+            # Out of time, not proven impossible: a diagnostic solve would
+            # only keep the caller waiting for a vague answer.
+            return False, None, _TIMEOUT_ERROR.format(timeout=timeout)
+        if status:
+            if result_key is not None:
+                try:
+                    await self.cache.set(
+                        result_key,
+                        _dump_entries(result),
+                        ttl=settings.SCHEDULER_RESULT_CACHE_TTL,
+                    )
+                except Exception as e:
+                    logger.warning("Could not write schedule result cache: %s", e)
+            return True, result, None
+        if result is not None:
+            _infeasible_cache[data_key] = result
+            if len(_infeasible_cache) > INFEASIBLE_CACHE_MAX:
+                _infeasible_cache.popitem(last=False)
+            return False, None, result
+        return False, None, _UNSAT_ERROR
+
+    async def _solve_portfolio(
+        self, data: Dict, timeout: int, diagnose_timeout: Optional[int] = None
+    ) -> Tuple[Optional[bool], Any]:
+        """
+        Races the SCHEDULER_PORTFOLIO_SOLVERS backends on the institution data,
+        each in a solver process of its own, and returns the first definite
+        answer. The remaining processes are killed as soon as one answers, and
+        all of them once ``timeout`` seconds have passed.
+
+        A backend that fails (its process raises or dies) is logged and left
+        out of the race.
+
+        Returns:
+            (status, result) as in _run_solver; status is None when no backend
+            answered in time
+
+        Raises:
+            RuntimeError: If every backend failed
+        """
+        limit = timeout
+        if diagnose_timeout is not None:
+            # The diagnostic is interrupted at the same deadline; the extra
+            # second lets its answer reach the pipe before the kill.
+            limit += 1
+        runs = {
+            asyncio.ensure_future(
+                _call_in_process(
+                    self._run_solver,
+                    data,
+                    self.cache_dir,
+                    timeout,
+                    solver_name,
+                    diagnose_timeout,
+                    timeout=limit,
+                )
+            ): solver_name
+            for solver_name in settings.SCHEDULER_PORTFOLIO_SOLVERS
         }
-        _debug_serialized = _serialize_for_debug_log(_debug_payload)
-        _debug_path = (
-            Path(__file__).resolve().parent.parent.parent
-            / "schedule_generation_input_debug.json"
-        )
+        failures = 0
         try:
-            with open(_debug_path, "w", encoding="utf-8") as f:
-                json.dump(_debug_serialized, f, ensure_ascii=False, indent=2)
-            logger.info("Schedule generation input logged to %s", _debug_path)
-        except Exception as e:
-            logger.warning("Could not write schedule input debug file: %s", e)
-        # --- конец временного логирования ---
-
-        encoder = ScheduleEncoder()
-        study_groups = data.get("study_groups", [])
-        class_group_lessons = data.get("class_group_lessons", {})
-        study_group_lessons = data.get("study_group_lessons", {})
-        encoder.encode_variables(
-            lessons=data["lessons"],
-            teachers=data["teachers"],
-            class_groups=data["class_groups"],
-            study_groups=study_groups,
-            rooms=data["rooms"],
-            time_slots=data["time_slots"],
-            teacher_lessons=data["teacher_lessons"],
-            class_group_lessons=class_group_lessons,
-            study_group_lessons=study_group_lessons,
-        )
-        infeasible = encoder.get_infeasible_pairs(
-            class_group_lessons=class_group_lessons,
-            study_group_lessons=study_group_lessons,
-            room_capacities=data["room_capacities"],
-            class_group_sizes=data["class_group_sizes"],
-            study_group_sizes=data.get("study_group_sizes", {}),
-        )
-        if infeasible:
-            parts = [f"lesson {l} group {g}: {r}" for l, g, r in infeasible]
-            return False, None, "Infeasible: " + "; ".join(parts)
-        encoder.encode_hard_constraints(
-            lessons=data["lessons"],
-            class_groups=data["class_groups"],
-            study_groups=study_groups,
-            teachers=data["teachers"],
-            rooms=data["rooms"],
-            time_slots=data["time_slots"],
-            room_capacities=data["room_capacities"],
-            class_group_sizes=data["class_group_sizes"],
-            study_group_sizes=data.get("study_group_sizes", {}),
-            student_group_memberships=data.get("student_group_memberships", {}),
-            class_group_lessons=class_group_lessons,
-            study_group_lessons=study_group_lessons,
-        )
-        encoder.encode_custom_constraints(data["constraints"])
+            async for run in asyncio.as_completed(runs):
+                try:
+                    finished, answer = await run
+                except Exception as e:
+                    logger.error("Portfolio solver %s failed: %s", runs[run], e)
+                    failures += 1
+                    continue
+                if finished and answer[0] is not None:
+                    return answer
+        finally:
+            for run in runs:
+                run.cancel()
+        if failures == len(runs):
+            raise RuntimeError("Every portfolio solver failed")
+        return None, None
+
+    @staticmethod
+    def _run_solver(
+        data: Dict,
+        cache_dir: Optional[Path],
+        timeout: int,
+        solver_name: str = "cadical153",
+        diagnose_timeout: Optional[int] = None,
+    ) -> Tuple[Optional[bool], Any]:
+        """
+        Encodes and solves the institution data (blocking; runs in a solver
+        process, so only ``data`` is sent over and only the rows come back).
+
+        With ``diagnose_timeout``, an unsatisfiable instance is explained in the
+        same process by _diagnose_unsat on the encoding just built, within what
+        is left of ``timeout``.
+
+        Returns:
+            (status, result): (True, schedule rows) if solved; (False, error) if
+            the capacity/availability precheck fails, with an "Infeasible: ..."
+            message, or if unsatisfiable and diagnosed; (False, None) if
+            unsatisfiable otherwise; (None, None) if ``timeout`` (counting the
+            encoding) ran out first and the backend could stop
+        """
+        started = time.monotonic()
+        encoder, error = _encode(data, cache_dir)
+        if error is not None:
+            return False, error
         with ScheduleSolver(encoder) as solver:
-            if solver.solve(timeout=timeout):
-                schedule = solver.extract_schedule()
-                schedule_entries = []
-                group_types = encoder.group_types
-                for (
-                    lesson_id,
-                    teacher_id,
-                    group_id,
-                    room_id,
-                    time_slot_id,
-                ) in schedule:
-                    group_type = group_types.get(group_id, "class_group")
-                    entry = {
-                        "lesson_id": lesson_id,
-                        "teacher_id": teacher_id,
-                        "room_id": room_id,
-                        "time_slot_id": time_slot_id,
-                    }
-                    if group_type == "class_group":
-                        entry["class_group_id"] = group_id
-                        entry["study_group_id"] = None
-                    else:
-                        entry["class_group_id"] = None
-                        entry["study_group_id"] = group_id
-                    schedule_entries.append(entry)
-
-                return True, schedule_entries, None
-            else:
-                # Diagnostic: can assignments be made without pairwise conflicts?
-                diag = ScheduleEncoder()
-                diag.encode_variables(
-                    lessons=data["lessons"],
-                    teachers=data["teachers"],
-                    class_groups=data["class_groups"],
-                    study_groups=study_groups,
-                    rooms=data["rooms"],
-                    time_slots=data["time_slots"],
-                    teacher_lessons=data["teacher_lessons"],
-                    class_group_lessons=class_group_lessons,
-                    study_group_lessons=study_group_lessons,
+            status = solver.solve(
+                timeout=max(0, timeout - (time.monotonic() - started)),
+                solver_name=solver_name,
+            )
+            if status is None:
+                return None, None
+            if not status:
+                if diagnose_timeout is None:
+                    return False, None
+                # Release the main solver before loading the relaxed encoding.
+                solver.close()
+                remaining = started + timeout - time.monotonic()
+                return False, ScheduleGenerator._diagnose_unsat(
+                    encoder, min(diagnose_timeout, remaining)
                 )
-                diag.encode_hard_constraints(
-                    lessons=data["lessons"],
-                    class_groups=data["class_groups"],
-                    study_groups=study_groups,
-                    teachers=data["teachers"],
-                    rooms=data["rooms"],
-                    time_slots=data["time_slots"],
-                    room_capacities=data["room_capacities"],
-                    class_group_sizes=data["class_group_sizes"],
-                    study_group_sizes=data.get("study_group_sizes", {}),
-                    student_group_memberships=data.get("student_group_memberships", {}),
-                    class_group_lessons=class_group_lessons,
-                    study_group_lessons=study_group_lessons,
-                    skip_conflicts=True,
+            schedule = solver.extract_schedule()
+        # Class-group rows first, then study-group rows, so each comprehension
+        # fills a fixed id field instead of choosing one per row.
+        class_group_ids = encoder.class_group_ids
+        rows = [
+            ScheduleRow(lesson_id, teacher_id, group_id, None, room_id, ts_id)
+            for lesson_id, teacher_id, group_id, room_id, ts_id in schedule
+            if group_id in class_group_ids
+        ]
+        rows += [
+            ScheduleRow(lesson_id, teacher_id, None, group_id, room_id, ts_id)
+            for lesson_id, teacher_id, group_id, room_id, ts_id in schedule
+            if group_id not in class_group_ids
+        ]
+        return True, rows
+
+    @staticmethod
+    def _diagnose_unsat(encoder: ScheduleEncoder, timeout: float) -> str:
+        """
+        Explains an unsatisfiable instance by re-solving its encoding without the
+        pairwise conflict constraints (teacher, group, room and student overlap).
+
+        Args:
+            encoder: Full encoding that was proven unsatisfiable
+            timeout: Maximum solving time in seconds
+
+        Returns:
+            Error message for the caller
+        """
+        # Diagnostic: can assignments be made without pairwise conflicts? The
+        # backend must be interruptible so the solve ends within its budget.
+        with ScheduleSolver(encoder.without_conflicts()) as diag_solver:
+            status = diag_solver.solve(
+                timeout=max(0, timeout), solver_name=_DIAGNOSE_SOLVER
+            )
+            if status is None:
+                return _UNSAT_ERROR
+            if status:
+                return (
+                    "No solution: resource conflicts make the schedule impossible "
+                    "(teacher, room, or student overlap in at least one time slot). "
+                    "Try: more time slots, more teachers, or more rooms."
                 )
-                diag.encode_custom_constraints(data["constraints"])
-                with ScheduleSolver(diag) as diag_solver:
-                    if diag_solver.solve(timeout=timeout):
-                        return (
-                            False,
-                            None,
-                            "No solution: resource conflicts make the schedule impossible "
-                            "(teacher, room, or student overlap in at least one time slot). "
-                            "Try: more time slots, more teachers, or more rooms.",
-                        )
-                    else:
-                        return (
-                            False,
-                            None,
-                            "No solution: some (lesson, group) pairs have no valid "
-                            "(teacher, room, time slot) after room capacity and "
-                            "teacher/room unavailability. Check room capacity and "
-                            "teacher/room availability constraints.",
-                        )
+            return (
+                "No solution: some (lesson, group) pairs have no valid "
+                "(teacher, room, time slot) after room capacity and "
+                "teacher/room unavailability. Check room capacity and "
+                "teacher/room availability constraints."
+            )
 
     async def apply_constraints(
         self, institution_id: UUID, constraints: List[Dict]
@@ -297,6 +626,8 @@ class ScheduleGenerator:
         Returns:
             Updated data with applied constraints
         """
+        # The result is mutated below, so it must not be the cached copy.
+        self._build_cache.pop(institution_id, None)
         data = await self.constraint_builder.build_from_institution(institution_id)
         data["constraints"].extend(constraints)
         return data
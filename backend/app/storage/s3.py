@@ -2,10 +2,11 @@
 Module for working with S3-compatible storage (e.g., MinIO).
 """
 
+import asyncio
 import base64
-import io
-from contextlib import asynccontextmanager
-from typing import Any, BinaryIO, Optional
+from itertools import batched
+from typing import Any, AsyncIterable, BinaryIO, Optional
+from urllib.parse import urlsplit, urlunsplit
 
 import aioboto3
 from botocore.exceptions import ClientError
@@ -30,9 +31,28 @@ def _sanitize_metadata(metadata: dict[str, Any]) -> dict[str, str]:
     return {k: _metadata_value_to_ascii(v) for k, v in metadata.items()}
 
 
+def _object_args(
+    content_type: Optional[str], metadata: Optional[dict]
+) -> dict[str, Any]:
+    """Build the optional ContentType/Metadata arguments of an upload."""
+    args: dict[str, Any] = {}
+    if content_type:
+        args["ContentType"] = content_type
+    if metadata:
+        args["Metadata"] = _sanitize_metadata(metadata)
+    return args
+
+
 class S3Storage:
     """Class for interacting with an S3-compatible storage backend."""
 
+    # S3 requires every multipart part except the last to be at least 5 MiB.
+    MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+    # Objects larger than this must be read with download_file_stream.
+    MAX_IN_MEMORY_SIZE = 64 * 1024 * 1024
+    # Maximum number of keys accepted by a single DeleteObjects request.
+    DELETE_BATCH_SIZE = 1000
+
     def __init__(self):
         self.endpoint_url = settings.S3_ENDPOINT_URL
         self.public_url = settings.S3_PUBLIC_URL
@@ -42,33 +62,56 @@ class S3Storage:
         self.bucket_name = settings.S3_BUCKET_NAME
         self.use_ssl = settings.S3_USE_SSL
 
-        self.session = aioboto3.Session()
+        # Presigned URLs point at the internal endpoint; these parts are used
+        # to rewrite them onto the public URL.
+        self._endpoint_netloc = urlsplit(self.endpoint_url).netloc.lower()
+        public = urlsplit(self.public_url)
+        self._public_scheme = public.scheme
+        self._public_netloc = public.netloc
+        self._public_path = public.path.rstrip("/")
 
-    @asynccontextmanager
-    async def get_client(self):
-        """Return an S3 client."""
-        async with self.session.client(
-            "s3",
-            endpoint_url=self.endpoint_url,
-            aws_access_key_id=self.access_key_id,
-            aws_secret_access_key=self.secret_access_key,
-            region_name=self.region,
-            use_ssl=self.use_ssl,
-        ) as client:
-            yield client
+        self.session = aioboto3.Session()
+        # One client (and connection pool) shared by all operations.
+        self._client_cm = None
+        self._client = None
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self):
+        """Create the S3 client if not already connected."""
+        if self._client is None:
+            async with self._connect_lock:
+                if self._client is None:
+                    client_cm = self.session.client(
+                        "s3",
+                        endpoint_url=self.endpoint_url,
+                        aws_access_key_id=self.access_key_id,
+                        aws_secret_access_key=self.secret_access_key,
+                        region_name=self.region,
+                        use_ssl=self.use_ssl,
+                    )
+                    self._client = await client_cm.__aenter__()
+                    self._client_cm = client_cm
+        return self._client
+
+    async def close(self):
+        """Close the S3 client if open."""
+        if self._client_cm is not None:
+            client_cm = self._client_cm
+            self._client_cm = None
+            self._client = None
+            await client_cm.__aexit__(None, None, None)
 
     async def ensure_bucket_exists(self):
         """Create the bucket if it does not exist."""
+        client = await self.connect()
         try:
-            async with self.get_client() as client:
-                await client.head_bucket(Bucket=self.bucket_name)
-                logger.debug(f"Bucket {self.bucket_name} already exists")
+            await client.head_bucket(Bucket=self.bucket_name)
+            logger.debug(f"Bucket {self.bucket_name} already exists")
         except ClientError as e:
             error_code = e.response.get("Error", {}).get("Code", "")
             if error_code == "404":
-                async with self.get_client() as client:
-                    await client.create_bucket(Bucket=self.bucket_name)
-                    logger.info(f"Created bucket {self.bucket_name}")
+                await client.create_bucket(Bucket=self.bucket_name)
+                logger.info(f"Created bucket {self.bucket_name}")
             else:
                 logger.error(f"Error checking bucket: {e}")
                 raise
@@ -92,18 +135,13 @@ class S3Storage:
         Returns:
             Absolute URL of the uploaded file
         """
-        await self.ensure_bucket_exists()
-
-        extra_args = {}
-        if content_type:
-            extra_args["ContentType"] = content_type
-        if metadata:
-            extra_args["Metadata"] = _sanitize_metadata(metadata)
-
-        async with self.get_client() as client:
-            await client.upload_fileobj(
-                file_obj, self.bucket_name, object_key, ExtraArgs=extra_args
-            )
+        client = await self.connect()
+        await client.upload_fileobj(
+            file_obj,
+            self.bucket_name,
+            object_key,
+            ExtraArgs=_object_args(content_type, metadata),
+        )
 
         logger.info(f"Uploaded file to s3://{self.bucket_name}/{object_key}")
         return f"{self.endpoint_url}/{self.bucket_name}/{object_key}"
@@ -116,16 +154,99 @@ class S3Storage:
         metadata: Optional[dict] = None,
     ) -> str:
         """
-        Upload raw bytes into S3.
+        Upload raw bytes into S3. Meant for small payloads; use upload_stream
+        for large ones.
 
         Args:
             data: Bytes to upload
             object_key: S3 object key
             content_type: MIME type
             metadata: Additional metadata
+
+        Returns:
+            Absolute URL of the uploaded file
         """
-        file_obj = io.BytesIO(data)
-        return await self.upload_file(file_obj, object_key, content_type, metadata)
+        # The payload is already in memory, so a single PutObject request is
+        # enough; upload_fileobj would add multipart bookkeeping on top.
+        client = await self.connect()
+        await client.put_object(
+            Bucket=self.bucket_name,
+            Key=object_key,
+            Body=data,
+            **_object_args(content_type, metadata),
+        )
+
+        logger.info(f"Uploaded file to s3://{self.bucket_name}/{object_key}")
+        return f"{self.endpoint_url}/{self.bucket_name}/{object_key}"
+
+    async def upload_stream(
+        self,
+        chunks: AsyncIterable[bytes],
+        object_key: str,
+        content_type: Optional[str] = None,
+        metadata: Optional[dict] = None,
+    ) -> str:
+        """
+        Upload a stream of chunks into S3 as a multipart upload, holding at
+        most about MULTIPART_CHUNK_SIZE bytes in memory.
+
+        Args:
+            chunks: Async iterable of byte chunks
+            object_key: S3 object key
+            content_type: MIME type
+            metadata: Additional metadata
+
+        Returns:
+            Absolute URL of the uploaded file
+        """
+        client = await self.connect()
+        upload = await client.create_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=object_key,
+            **_object_args(content_type, metadata),
+        )
+        upload_id = upload["UploadId"]
+        parts = []
+
+        async def upload_part(body: bytes) -> None:
+            part_number = len(parts) + 1
+            response = await client.upload_part(
+                Bucket=self.bucket_name,
+                Key=object_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+            parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+        try:
+            buffer = bytearray()
+            async for chunk in chunks:
+                buffer += chunk
+                if len(buffer) >= self.MULTIPART_CHUNK_SIZE:
+                    await upload_part(bytes(buffer))
+                    buffer.clear()
+            # A multipart upload needs at least one part, even an empty one.
+            if buffer or not parts:
+                await upload_part(bytes(buffer))
+            await client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=object_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            # A failed abort must not mask the error that caused it.
+            try:
+                await client.abort_multipart_upload(
+                    Bucket=self.bucket_name, Key=object_key, UploadId=upload_id
+                )
+            except Exception as e:
+                logger.error(f"Error aborting multipart upload {upload_id}: {e}")
+            raise
+
+        logger.info(f"Uploaded file to s3://{self.bucket_name}/{object_key}")
+        return f"{self.endpoint_url}/{self.bucket_name}/{object_key}"
 
     async def download_file(self, object_key: str) -> bytes:
         """
@@ -133,10 +254,20 @@ class S3Storage:
 
         Args:
             object_key: S3 object key
+
+        Raises:
+            ValueError: If the object exceeds MAX_IN_MEMORY_SIZE; use
+                download_file_stream instead
         """
-        async with self.get_client() as client:
-            response = await client.get_object(Bucket=self.bucket_name, Key=object_key)
-            return await response["Body"].read()
+        client = await self.connect()
+        response = await client.get_object(Bucket=self.bucket_name, Key=object_key)
+        if response["ContentLength"] > self.MAX_IN_MEMORY_SIZE:
+            response["Body"].close()
+            raise ValueError(
+                f"Object {object_key} is {response['ContentLength']} bytes, "
+                "too large to download into memory; use download_file_stream"
+            )
+        return await response["Body"].read()
 
     async def download_file_stream(self, object_key: str):
         """
@@ -148,10 +279,15 @@ class S3Storage:
         Yields:
             Chunks of file data
         """
-        async with self.get_client() as client:
-            response = await client.get_object(Bucket=self.bucket_name, Key=object_key)
+        client = await self.connect()
+        response = await client.get_object(Bucket=self.bucket_name, Key=object_key)
+        # Close the body even if the consumer stops early, so the connection
+        # goes back to the shared client's pool.
+        try:
             async for chunk in response["Body"]:
                 yield chunk
+        finally:
+            response["Body"].close()
 
     async def delete_file(self, object_key: str) -> bool:
         """
@@ -163,21 +299,69 @@ class S3Storage:
         Returns:
             True if deleted, False if not found
         """
+        client = await self.connect()
         try:
-            async with self.get_client() as client:
-                await client.delete_object(Bucket=self.bucket_name, Key=object_key)
-                logger.info(f"Deleted file s3://{self.bucket_name}/{object_key}")
-                return True
+            await client.delete_object(Bucket=self.bucket_name, Key=object_key)
+            logger.info(f"Deleted file s3://{self.bucket_name}/{object_key}")
+            return True
         except ClientError as e:
             logger.error(f"Error deleting file: {e}")
             return False
 
+    async def delete_files(self, object_keys: list[str]) -> dict[str, bool]:
+        """
+        Delete several objects from S3, up to DELETE_BATCH_SIZE keys per
+        request, with the batches sent concurrently.
+
+        Args:
+            object_keys: S3 object keys
+
+        Returns:
+            Mapping of each key to True if deleted, False on error
+        """
+        client = await self.connect()
+
+        async def delete_batch(keys: tuple[str, ...]) -> dict[str, bool]:
+            try:
+                response = await client.delete_objects(
+                    Bucket=self.bucket_name,
+                    Delete={"Objects": [{"Key": k} for k in keys], "Quiet": True},
+                )
+            except ClientError as e:
+                logger.error(f"Error deleting files: {e}")
+                return dict.fromkeys(keys, False)
+            # DeleteObjects succeeds as a request even when single keys fail;
+            # in quiet mode only those failed keys are reported back.
+            result = dict.fromkeys(keys, True)
+            for error in response.get("Errors", []):
+                key = error.get("Key")
+                logger.error(
+                    f"Error deleting file s3://{self.bucket_name}/{key}: "
+                    f"{error.get('Code')} {error.get('Message')}"
+                )
+                if key in result:
+                    result[key] = False
+            return result
+
+        results = await asyncio.gather(
+            *(
+                delete_batch(keys)
+                for keys in batched(object_keys, self.DELETE_BATCH_SIZE)
+            )
+        )
+        deleted = {k: ok for result in results for k, ok in result.items()}
+        logger.info(
+            f"Deleted {sum(deleted.values())} of {len(deleted)} files "
+            f"from s3://{self.bucket_name}"
+        )
+        return deleted
+
     async def file_exists(self, object_key: str) -> bool:
         """Check if an object exists in S3."""
+        client = await self.connect()
         try:
-            async with self.get_client() as client:
-                await client.head_object(Bucket=self.bucket_name, Key=object_key)
-                return True
+            await client.head_object(Bucket=self.bucket_name, Key=object_key)
+            return True
         except ClientError as e:
             if e.response.get("Error", {}).get("Code") == "404":
                 return False
@@ -191,49 +375,106 @@ class S3Storage:
             object_key: S3 object key
             expires_in: Expiration in seconds
         """
-        async with self.get_client() as client:
-            presigned_url = await client.generate_presigned_url(
-                "get_object",
-                Params={"Bucket": self.bucket_name, "Key": object_key},
-                ExpiresIn=expires_in,
-            )
-            if self.endpoint_url != self.public_url:
-                presigned_url = presigned_url.replace(
-                    self.endpoint_url, self.public_url
+        client = await self.connect()
+        presigned_url = await client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket_name, "Key": object_key},
+            ExpiresIn=expires_in,
+        )
+        if self.endpoint_url != self.public_url:
+            parts = urlsplit(presigned_url)
+            if parts.netloc.lower() == self._endpoint_netloc:
+                presigned_url = urlunsplit(
+                    parts._replace(
+                        scheme=self._public_scheme,
+                        netloc=self._public_netloc,
+                        path=self._public_path + parts.path,
+                    )
                 )
-            return presigned_url
+        return presigned_url
 
-    async def list_files(self, prefix: str = "") -> list[dict]:
+    async def list_files(
+        self,
+        prefix: str = "",
+        prefixes: Optional[list[str]] = None,
+        concurrency: int = 8,
+    ) -> list[dict]:
         """
         List files in the bucket optionally filtered by prefix.
 
+        Pages of a single prefix have to be fetched one after another
+        (each request needs the previous continuation token), so when
+        several prefixes are given they are listed concurrently instead.
+
+        Args:
+            prefix: Key prefix to list
+            prefixes: Several key prefixes to list concurrently; overrides prefix
+            concurrency: Maximum number of prefixes listed at once
+
         Returns:
             List of dicts containing object metadata
         """
+        if prefixes is None:
+            return await self._list_prefix(prefix)
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def list_one(p: str) -> list[dict]:
+            async with semaphore:
+                return await self._list_prefix(p)
+
+        results = await asyncio.gather(*(list_one(p) for p in prefixes))
+        return [obj for files in results for obj in files]
+
+    async def _list_prefix(self, prefix: str) -> list[dict]:
+        """List all objects under one prefix, following pagination."""
         files = []
-        async with self.get_client() as client:
-            paginator = client.get_paginator("list_objects_v2")
-            async for page in paginator.paginate(
-                Bucket=self.bucket_name, Prefix=prefix
-            ):
-                for obj in page.get("Contents", []):
-                    files.append(
-                        {
-                            "key": obj["Key"],
-                            "size": obj["Size"],
-                            "last_modified": obj["LastModified"].isoformat(),
-                        }
-                    )
+        client = await self.connect()
+        paginator = client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                files.append(
+                    {
+                        "key": obj["Key"],
+                        "size": obj["Size"],
+                        "last_modified": obj["LastModified"].isoformat(),
+                    }
+                )
         return files
 
 
 _storage_instance: Optional[S3Storage] = None
+# Serializes creating (and closing) the singleton, so concurrent first requests
+# do not each build a client.
+_storage_lock = asyncio.Lock()
 
 
 async def get_s3_client() -> S3Storage:
     """FastAPI dependency that returns a singleton S3Storage instance."""
     global _storage_instance
     if _storage_instance is None:
-        _storage_instance = S3Storage()
-        await _storage_instance.ensure_bucket_exists()
+        async with _storage_lock:
+            if _storage_instance is None:
+                storage = S3Storage()
+                # Uploads rely on the bucket existing, so only keep the instance
+                # once the check has succeeded; a failed attempt is retried on
+                # next use.
+                try:
+                    await storage.ensure_bucket_exists()
+                except Exception:
+                    await storage.close()
+                    raise
+                _storage_instance = storage
     return _storage_instance
+
+
+async def close_s3_client() -> None:
+    """Closes the shared S3 client on application shutdown."""
+    global _storage_instance
+    async with _storage_lock:
+        if _storage_instance is not None:
+            storage = _storage_instance
+            # Reset first so a later get_s3_client() builds a fresh instance
+            # instead of returning the closed one.
+            _storage_instance = None
+            await storage.close()
@@ -0,0 +1,147 @@
+"""
+Tests for the S3 storage wrapper against a stubbed client.
+"""
+
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+
+from app.storage import s3
+from app.storage.s3 import S3Storage
+
+
+def _run(coro):
+    """Run async test without pytest-asyncio."""
+    return asyncio.run(coro)
+
+
+def test_close_s3_client_resets_singleton():
+    """After shutdown the next get_s3_client() builds a new instance."""
+    with (
+        patch.object(S3Storage, "ensure_bucket_exists", AsyncMock()),
+        patch.object(S3Storage, "close", AsyncMock()) as close,
+    ):
+        first = _run(s3.get_s3_client())
+        _run(s3.close_s3_client())
+        assert s3._storage_instance is None
+        close.assert_awaited_once()
+
+        second = _run(s3.get_s3_client())
+        assert second is not first
+        _run(s3.close_s3_client())
+
+
+def test_get_s3_client_builds_one_instance_for_concurrent_requests():
+    async def first_requests():
+        return await asyncio.gather(*(s3.get_s3_client() for _ in range(5)))
+
+    async def slow_check(self):
+        await asyncio.sleep(0.01)
+
+    with (
+        patch.object(S3Storage, "ensure_bucket_exists", slow_check),
+        patch.object(S3Storage, "close", AsyncMock()),
+        patch.object(S3Storage, "__init__", return_value=None) as init,
+    ):
+        clients = _run(first_requests())
+        _run(s3.close_s3_client())
+    assert all(client is clients[0] for client in clients)
+    init.assert_called_once()
+
+
+def _storage(client):
+    """An S3Storage whose connect() returns the given stub client."""
+    storage = S3Storage()
+    storage._client = client
+    return storage
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _multipart_client():
+    client = AsyncMock()
+    client.create_multipart_upload.return_value = {"UploadId": "up-1"}
+    client.upload_part.side_effect = lambda **kw: {"ETag": f"etag-{kw['PartNumber']}"}
+    return client
+
+
+def test_upload_stream_uploads_parts_and_completes():
+    client = _multipart_client()
+    storage = _storage(client)
+    size = S3Storage.MULTIPART_CHUNK_SIZE
+
+    _run(storage.upload_stream(_stream(b"a" * size, b"b" * size, b"c"), "key"))
+
+    bodies = [c.kwargs["Body"] for c in client.upload_part.await_args_list]
+    assert bodies == [b"a" * size, b"b" * size, b"c"]
+    client.complete_multipart_upload.assert_awaited_once()
+    parts = client.complete_multipart_upload.await_args.kwargs["MultipartUpload"]
+    assert parts == {
+        "Parts": [
+            {"ETag": "etag-1", "PartNumber": 1},
+            {"ETag": "etag-2", "PartNumber": 2},
+            {"ETag": "etag-3", "PartNumber": 3},
+        ]
+    }
+    client.abort_multipart_upload.assert_not_awaited()
+
+
+def test_upload_stream_aborts_on_error_and_keeps_original_error():
+    client = _multipart_client()
+    client.complete_multipart_upload.side_effect = RuntimeError("complete failed")
+    client.abort_multipart_upload.side_effect = RuntimeError("abort failed")
+    storage = _storage(client)
+
+    with pytest.raises(RuntimeError, match="complete failed"):
+        _run(storage.upload_stream(_stream(b"data"), "key"))
+
+    client.abort_multipart_upload.assert_awaited_once_with(
+        Bucket=storage.bucket_name, Key="key", UploadId="up-1"
+    )
+
+
+def test_delete_files_batches_keys_and_reports_per_key_errors():
+    keys = [f"file-{i}" for i in range(2500)]
+    client = AsyncMock()
+
+    async def delete_objects(Bucket, Delete):
+        batch = [obj["Key"] for obj in Delete["Objects"]]
+        if "file-1500" in batch:
+            return {"Errors": [{"Key": "file-1500", "Code": "AccessDenied"}]}
+        return {}
+
+    client.delete_objects.side_effect = delete_objects
+    storage = _storage(client)
+
+    with patch.object(s3.logger, "error") as log_error:
+        deleted = _run(storage.delete_files(keys))
+
+    sizes = [
+        len(c.kwargs["Delete"]["Objects"])
+        for c in client.delete_objects.await_args_list
+    ]
+    assert sizes == [1000, 1000, 500]
+    assert deleted == {key: key != "file-1500" for key in keys}
+    log_error.assert_called_once()
+    assert "file-1500" in log_error.call_args.args[0]
+
+
+def test_download_file_stream_closes_body_when_consumer_stops():
+    body = MagicMock()
+    body.__aiter__.return_value = [b"a", b"b", b"c"]
+    client = AsyncMock()
+    client.get_object.return_value = {"Body": body}
+    storage = _storage(client)
+
+    async def read_first():
+        stream = storage.download_file_stream("key")
+        first = await anext(stream)
+        await stream.aclose()
+        return first
+
+    assert _run(read_first()) == b"a"
+    body.close.assert_called_once()
@@ -6,11 +6,18 @@ time slot when they use different teachers and different rooms.
 """
 
 import asyncio
+import signal
+import time
 import uuid
+from contextlib import contextmanager
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
 
+from app.core.config import Settings
+from app.scheduler import schedule_generator
+from app.scheduler.sat_encoder import ScheduleEncoder, unavailable_slots
+from app.scheduler.sat_solver import ScheduleSolver
 from app.scheduler.schedule_generator import ScheduleGenerator
 
 
@@ -19,6 +26,21 @@ def _run(coro):
     return asyncio.run(coro)
 
 
+@contextmanager
+def _record_solver_processes():
+    """Collects the solver processes started inside the block."""
+    started = []
+    spawn = schedule_generator._solver_context.Process
+
+    def record(*args, **kwargs):
+        process = spawn(*args, **kwargs)
+        started.append(process)
+        return process
+
+    with patch.object(schedule_generator._solver_context, "Process", record):
+        yield started
+
+
 @pytest.mark.parametrize("use_class_groups", [True, False])
 def test_two_groups_same_slot_no_conflict(use_class_groups):
     """
@@ -67,14 +89,16 @@ def test_two_groups_same_slot_no_conflict(use_class_groups):
             "build_from_institution",
             new_callable=AsyncMock,
             return_value=data,
-        ):
-            return await gen.generate(uuid.uuid4(), timeout=15)
+        ) as build:
+            result = await gen.generate(uuid.uuid4(), timeout=15)
+        build.assert_awaited_once()
+        return result
 
     ok, entries, err = _run(run_generate())
     assert ok is True, f"expected success, got err={err}"
     assert entries is not None
     assert len(entries) == 2
-    slots = {e["time_slot_id"] for e in entries}
+    slots = {e.time_slot_id for e in entries}
     assert len(slots) == 1
     assert ts1 in slots
 
@@ -118,7 +142,8 @@ def test_unsat_returns_diagnostic():
         ):
             return await gen.generate(uuid.uuid4(), timeout=10)
 
-    ok, entries, err = _run(run_generate())
+    with patch.dict(schedule_generator._infeasible_cache, clear=True):
+        ok, entries, err = _run(run_generate())
     assert ok is False
     assert entries is None
     assert err is not None
@@ -126,6 +151,45 @@ def test_unsat_returns_diagnostic():
     assert "resource" in err.lower() or "conflict" in err.lower()
     assert "Constraints may be too restrictive" not in (err or "")
 
+    async def run_generate_without_diagnostics():
+        gen = ScheduleGenerator(MagicMock())
+        with patch.object(
+            gen.constraint_builder,
+            "build_from_institution",
+            new_callable=AsyncMock,
+            return_value=data,
+        ), patch.object(gen, "_solve_portfolio", wraps=gen._solve_portfolio) as solve:
+            result = await gen.generate(uuid.uuid4(), timeout=10, diagnose=False)
+        # No diagnostic budget: the workers stop at the UNSAT answer.
+        assert solve.await_args.args[2] is None
+        return result
+
+    with patch.dict(schedule_generator._infeasible_cache, clear=True):
+        ok, entries, err = _run(run_generate_without_diagnostics())
+    assert ok is False
+    assert entries is None
+    assert err == schedule_generator._UNSAT_ERROR
+
+    async def run_generate_timed_out():
+        gen = ScheduleGenerator(MagicMock())
+        with patch.object(
+            gen.constraint_builder,
+            "build_from_institution",
+            new_callable=AsyncMock,
+            return_value=data,
+        ), patch.object(
+            gen, "_solve_portfolio", new_callable=AsyncMock, return_value=(None, None)
+        ), patch.object(
+            gen, "_diagnose_unsat"
+        ) as diagnose:
+            result = await gen.generate(uuid.uuid4(), timeout=10)
+        diagnose.assert_not_called()
+        return result
+
+    ok, entries, err = _run(run_generate_timed_out())
+    assert ok is False
+    assert "within 10 s" in err
+
 
 def test_count_two_slots_for_one_lesson_group():
     """
@@ -169,10 +233,748 @@ def test_count_two_slots_for_one_lesson_group():
     assert entries is not None
     assert len(entries) == 2
     for e in entries:
-        assert e["lesson_id"] == lu1
-        assert e["class_group_id"] == cg1
-        assert e["study_group_id"] is None
-    time_slots_used = {e["time_slot_id"] for e in entries}
+        assert e.lesson_id == lu1
+        assert e.class_group_id == cg1
+        assert e.study_group_id is None
+    time_slots_used = {e.time_slot_id for e in entries}
     assert len(time_slots_used) == 2
     assert ts1 in time_slots_used
     assert ts2 in time_slots_used
+
+
+@pytest.mark.parametrize("slots", [1, 2])
+def test_student_overlap_class_and_study_group(slots):
+    """
+    A student in both a class group and a study group cannot attend two lessons at
+    once: with one slot the schedule is impossible even with spare teachers and
+    rooms; with two slots the lessons are placed in different slots.
+    """
+    lu1, lu2 = uuid.uuid4(), uuid.uuid4()
+    cg1, sg1 = uuid.uuid4(), uuid.uuid4()
+    r1, r2 = uuid.uuid4(), uuid.uuid4()
+    time_slots = [uuid.uuid4() for _ in range(slots)]
+    data = {
+        "lessons": [lu1, lu2],
+        "teachers": [1, 2],
+        "class_groups": [cg1],
+        "study_groups": [sg1],
+        "rooms": [r1, r2],
+        "time_slots": time_slots,
+        "teacher_lessons": {1: {lu1}, 2: {lu2}},
+        "class_group_lessons": {cg1: {lu1: 1}},
+        "study_group_lessons": {sg1: {lu2: 1}},
+        "room_capacities": {r1: 30, r2: 30},
+        "class_group_sizes": {cg1: 10},
+        "study_group_sizes": {sg1: 5},
+        "student_group_memberships": {
+            uuid.uuid4(): {"class_group_id": cg1, "study_group_ids": [sg1]},
+        },
+        "constraints": [],
+    }
+
+    async def run_generate():
+        db = MagicMock()
+        gen = ScheduleGenerator(db)
+        with patch.object(
+            gen.constraint_builder,
+            "build_from_institution",
+            new_callable=AsyncMock,
+            return_value=data,
+        ):
+            return await gen.generate(uuid.uuid4(), timeout=10)
+
+    ok, entries, err = _run(run_generate())
+    if slots == 1:
+        assert ok is False
+        assert "conflict" in err.lower()
+    else:
+        assert ok is True, f"expected success, got err={err}"
+        assert len({e.time_slot_id for e in entries}) == 2
+
+
+def test_room_too_small_reports_capacity():
+    """
+    Rooms that cannot hold a group get no variables; the diagnostic still names
+    room capacity rather than a missing teacher.
+    """
+    lu1, cg1, r1, ts1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    data = {
+        "lessons": [lu1],
+        "teachers": [1],
+        "class_groups": [cg1],
+        "study_groups": [],
+        "rooms": [r1],
+        "time_slots": [ts1],
+        "teacher_lessons": {1: {lu1}},
+        "class_group_lessons": {cg1: {lu1: 1}},
+        "study_group_lessons": {},
+        "room_capacities": {r1: 10},
+        "class_group_sizes": {cg1: 25},
+        "study_group_sizes": {},
+        "student_group_memberships": {},
+        "constraints": [],
+    }
+
+    async def run_generate():
+        db = MagicMock()
+        gen = ScheduleGenerator(db)
+        with patch.object(
+            gen.constraint_builder,
+            "build_from_institution",
+            new_callable=AsyncMock,
+            return_value=data,
+        ):
+            return await gen.generate(uuid.uuid4(), timeout=10)
+
+    ok, entries, err = _run(run_generate())
+    assert ok is False
+    assert "no room has sufficient capacity" in err
+
+
+def test_generate_remembers_infeasible_data():
+    """
+    Retrying generation with unchanged infeasible data returns the same error
+    without encoding the problem again.
+    """
+    lu1, cg1, r1, ts1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    data = {
+        "lessons": [lu1],
+        "teachers": [1],
+        "class_groups": [cg1],
+        "study_groups": [],
+        "rooms": [r1],
+        "time_slots": [ts1],
+        "teacher_lessons": {1: {lu1}},
+        "class_group_lessons": {cg1: {lu1: 1}},
+        "study_group_lessons": {},
+        "room_capacities": {r1: 10},
+        "class_group_sizes": {cg1: 25},
+        "study_group_sizes": {},
+        "student_group_memberships": {},
+        "constraints": [],
+    }
+
+    async def run_generate():
+        gen = ScheduleGenerator(MagicMock())
+        with patch.object(
+            gen.constraint_builder,
+            "build_from_institution",
+            new_callable=AsyncMock,
+            return_value=data,
+        ):
+            return await gen.generate(uuid.uuid4(), timeout=10)
+
+    with patch.dict(schedule_generator._infeasible_cache, clear=True):
+        first = _run(run_generate())
+        with patch.object(
+            ScheduleGenerator, "_solve_portfolio", new_callable=AsyncMock
+        ) as solve:
+            second = _run(run_generate())
+    assert first[0] is False and first[2].startswith("Infeasible")
+    assert second == first
+    solve.assert_not_awaited()
+
+
+def test_encoder_variable_cache_roundtrip(tmp_path):
+    """
+    A second encoder with the same inputs and cache directory restores the
+    variable mapping from disk instead of rebuilding it.
+    """
+    lu1, cg1, ts1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    r1, r2 = uuid.uuid4(), uuid.uuid4()
+    kwargs = {
+        "lessons": [lu1],
+        "teachers": [1],
+        "class_groups": [cg1],
+        "study_groups": [],
+        "rooms": [r1, r2],
+        "time_slots": [ts1],
+        "teacher_lessons": {1: {lu1}},
+        "class_group_lessons": {cg1: {lu1: 1}},
+        "study_group_lessons": {},
+        "room_capacities": {r1: 30, r2: 30},
+        "class_group_sizes": {cg1: 10},
+        "study_group_sizes": {},
+    }
+    first = ScheduleEncoder(cache_dir=tmp_path)
+    first.encode_variables(**kwargs)
+    assert len(list(tmp_path.iterdir())) == 1
+
+    second = ScheduleEncoder(cache_dir=tmp_path)
+    with patch.object(ScheduleEncoder, "_dump_variable_state") as dump:
+        second.encode_variables(**kwargs)
+    dump.assert_not_called()
+    assert second.variables == first.variables
+    assert second.next_var == first.next_var
+
+
+def test_encoder_cache_evicts_least_recently_used(tmp_path):
+    """The cache directory keeps at most cache_max_entries files, newest first."""
+    lu1, cg1, r1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+
+    def encode(time_slots):
+        encoder = ScheduleEncoder(cache_dir=tmp_path, cache_max_entries=2)
+        encoder.encode_variables(
+            lessons=[lu1],
+            teachers=[1],
+            class_groups=[cg1],
+            study_groups=[],
+            rooms=[r1],
+            time_slots=time_slots,
+            teacher_lessons={1: {lu1}},
+            class_group_lessons={cg1: {lu1: 1}},
+            study_group_lessons={},
+            room_capacities={r1: 30},
+            class_group_sizes={cg1: 10},
+            study_group_sizes={},
+        )
+
+    inputs = [[uuid.uuid4()] for _ in range(3)]
+    for time_slots in inputs:
+        encode(time_slots)
+    assert len(list(tmp_path.iterdir())) == 2
+
+    # The newest input is still cached; the oldest one was evicted.
+    with patch.object(ScheduleEncoder, "_dump_variable_state") as dump:
+        encode(inputs[2])
+    dump.assert_not_called()
+    with patch.object(ScheduleEncoder, "_dump_variable_state") as dump:
+        encode(inputs[0])
+    dump.assert_called_once()
+
+
+def test_solver_reuses_instance_and_loads_only_new_clauses():
+    """
+    A second solve() keeps the solver and pushes only clauses added since the
+    first call; assumptions apply to a single call.
+    """
+    encoder = ScheduleEncoder()
+    encoder.next_var = 3
+    encoder.get_clauses().append([1, 2])
+
+    with ScheduleSolver(encoder) as solver:
+        assert solver.solve() is True
+        first = solver.solver
+        assert solver.add_assumption(1, False) is True
+        assert solver.solve(assumptions=[-1, -2]) is False
+
+        encoder.get_clauses().append([-1])
+        with patch.object(
+            first, "append_formula", wraps=first.append_formula
+        ) as append:
+            assert solver.solve() is True
+        assert solver.solver is first
+        append.assert_called_once_with([[-1]], no_return=True)
+        assert 2 in solver.solver.get_model()
+
+
+def test_solver_conf_budget_applies_to_one_call():
+    """A conflict budget from one solve() does not limit a later unbudgeted one."""
+    # Pigeonhole: 5 pigeons, 4 holes; x(p, h) = 4 * p + h + 1.
+    encoder = ScheduleEncoder()
+    encoder.next_var = 21
+    holes = range(4)
+    clauses = encoder.get_clauses()
+    clauses.extend([4 * p + h + 1 for h in holes] for p in range(5))
+    clauses.extend(
+        [-(4 * p + h + 1), -(4 * q + h + 1)]
+        for h in holes
+        for p in range(5)
+        for q in range(p + 1, 5)
+    )
+
+    # MiniSat keeps a conflict budget across calls until it is reset.
+    with ScheduleSolver(encoder) as solver:
+        assert solver.solve(solver_name="minisat22", conf_budget=1) is None
+        assert solver.solve(solver_name="minisat22") is False
+
+
+def test_room_symmetry_breaking_fills_equal_rooms_in_order():
+    """
+    With symmetry breaking, a single lesson in a slot with two equally sized
+    rooms lands in the first one; an unavailable first room lifts the ordering.
+    """
+    lu1, cg1, ts1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    r1, r2 = uuid.uuid4(), uuid.uuid4()
+
+    def solve(constraints):
+        encoder = ScheduleEncoder()
+        encoder.encode_variables(
+            lessons=[lu1],
+            teachers=[1],
+            class_groups=[cg1],
+            study_groups=[],
+            rooms=[r1, r2],
+            time_slots=[ts1],
+            teacher_lessons={1: {lu1}},
+            class_group_lessons={cg1: {lu1: 1}},
+            study_group_lessons={},
+            room_capacities={r1: 30, r2: 30},
+            class_group_sizes={cg1: 10},
+            study_group_sizes={},
+        )
+        encoder.encode_hard_constraints(
+            lessons=[lu1],
+            class_groups=[cg1],
+            study_groups=[],
+            teachers=[1],
+            rooms=[r1, r2],
+            time_slots=[ts1],
+            student_group_memberships={},
+            class_group_lessons={cg1: {lu1: 1}},
+            study_group_lessons={},
+        )
+        encoder.encode_custom_constraints(constraints)
+        encoder.encode_room_symmetry_breaking(
+            rooms=[r1, r2],
+            time_slots=[ts1],
+            room_capacities={r1: 30, r2: 30},
+            constraints=constraints,
+        )
+        with ScheduleSolver(encoder) as solver:
+            assert solver.solve()
+            return solver.extract_schedule()
+
+    assert [entry[3] for entry in solve([])] == [r1]
+    unavailable = {
+        "constraint_type": "room_unavailable",
+        "constraint_data": {"room_id": r1, "time_slot_ids": [ts1]},
+    }
+    assert [entry[3] for entry in solve([unavailable])] == [r2]
+
+
+def test_teacher_symmetry_breaking_fills_equal_teachers_in_order():
+    """
+    Teachers with the same lessons are filled in order within a slot; an
+    unavailable first teacher lifts the ordering.
+    """
+    lu1, cg1, r1, ts1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    teacher_lessons = {1: {lu1}, 2: {lu1}}
+
+    def solve(constraints):
+        encoder = ScheduleEncoder()
+        encoder.encode_variables(
+            lessons=[lu1],
+            teachers=[1, 2],
+            class_groups=[cg1],
+            study_groups=[],
+            rooms=[r1],
+            time_slots=[ts1],
+            teacher_lessons=teacher_lessons,
+            class_group_lessons={cg1: {lu1: 1}},
+            study_group_lessons={},
+            room_capacities={r1: 30},
+            class_group_sizes={cg1: 10},
+            study_group_sizes={},
+        )
+        encoder.encode_hard_constraints(
+            lessons=[lu1],
+            class_groups=[cg1],
+            study_groups=[],
+            teachers=[1, 2],
+            rooms=[r1],
+            time_slots=[ts1],
+            student_group_memberships={},
+            class_group_lessons={cg1: {lu1: 1}},
+            study_group_lessons={},
+        )
+        encoder.encode_custom_constraints(constraints)
+        encoder.encode_teacher_symmetry_breaking(
+            teachers=[1, 2],
+            time_slots=[ts1],
+            teacher_lessons=teacher_lessons,
+            constraints=constraints,
+        )
+        with ScheduleSolver(encoder) as solver:
+            assert solver.solve()
+            return solver.extract_schedule()
+
+    assert [entry[1] for entry in solve([])] == [1]
+    unavailable = {
+        "constraint_type": "teacher_unavailable",
+        "constraint_data": {"teacher_id": 1, "time_slot_ids": [ts1]},
+    }
+    assert [entry[1] for entry in solve([unavailable])] == [2]
+
+
+def test_generate_reuses_cached_result():
+    """
+    A successful schedule is stored in the result cache; a second generate with
+    the same institution data returns it without solving again.
+    """
+    lu1, cg1, r1, ts1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    data = {
+        "lessons": [lu1],
+        "teachers": [1],
+        "class_groups": [cg1],
+        "study_groups": [],
+        "rooms": [r1],
+        "time_slots": [ts1],
+        "teacher_lessons": {1: {lu1}},
+        "class_group_lessons": {cg1: {lu1: 1}},
+        "study_group_lessons": {},
+        "room_capacities": {r1: 30},
+        "class_group_sizes": {cg1: 10},
+        "study_group_sizes": {},
+        "student_group_memberships": {},
+        "constraints": [],
+    }
+    store = {}
+    cache = MagicMock()
+    cache.get = AsyncMock(side_effect=lambda key: store.get(key))
+    cache.set = AsyncMock(
+        side_effect=lambda key, value, ttl=None: store.update({key: value})
+    )
+
+    async def run_generate():
+        gen = ScheduleGenerator(MagicMock(), cache=cache)
+        with patch.object(
+            gen.constraint_builder,
+            "build_from_institution",
+            new_callable=AsyncMock,
+            return_value=data,
+        ):
+            return await gen.generate(uuid.uuid4(), timeout=10)
+
+    first = _run(run_generate())
+    assert first[0] is True
+    assert len(store) == 1
+
+    with patch.object(
+        ScheduleGenerator, "_solve_portfolio", new_callable=AsyncMock
+    ) as solve:
+        second = _run(run_generate())
+    solve.assert_not_awaited()
+    assert second == first
+
+
+def test_without_conflicts_matches_skip_conflicts_encoding():
+    """
+    Dropping the recorded conflict spans from a full encoding (as the UNSAT
+    diagnostic does) gives exactly the clauses of an encoding built with
+    skip_conflicts=True.
+    """
+    lu1, lu2 = uuid.uuid4(), uuid.uuid4()
+    cg1, sg1 = uuid.uuid4(), uuid.uuid4()
+    r1, r2 = uuid.uuid4(), uuid.uuid4()
+    ts1, ts2 = uuid.uuid4(), uuid.uuid4()
+    student = uuid.uuid4()
+    kwargs = {
+        "lessons": [lu1, lu2],
+        "class_groups": [cg1],
+        "study_groups": [sg1],
+        "teachers": [1, 2],
+        "rooms": [r1, r2],
+        "time_slots": [ts1, ts2],
+        "class_group_lessons": {cg1: {lu1: 2}},
+        "study_group_lessons": {sg1: {lu2: 1}},
+    }
+    constraints = [
+        {
+            "constraint_type": "teacher_unavailable",
+            "constraint_data": {"teacher_id": 2, "time_slot_ids": [ts1]},
+        }
+    ]
+
+    def encode(skip_conflicts):
+        encoder = ScheduleEncoder()
+        encoder.encode_variables(
+            teacher_lessons={1: {lu1, lu2}, 2: {lu1, lu2}},
+            room_capacities={r1: 30, r2: 30},
+            class_group_sizes={cg1: 10},
+            study_group_sizes={sg1: 5},
+            **kwargs,
+        )
+        encoder.encode_hard_constraints(
+            student_group_memberships={
+                student: {"class_group_id": cg1, "study_group_ids": [sg1]}
+            },
+            skip_conflicts=skip_conflicts,
+            **kwargs,
+        )
+        encoder.encode_custom_constraints(constraints)
+        return encoder
+
+    full = encode(False)
+    relaxed = full.without_conflicts()
+    assert relaxed.get_clauses() == encode(True).get_clauses()
+    assert len(relaxed.get_clauses()) < len(full.get_clauses())
+
+
+def test_unsat_diagnostic_reuses_main_encoding():
+    """
+    On UNSAT the worker diagnoses from the encoding it already built instead
+    of encoding the data a second time.
+    """
+    lu1, lu2, cg1, cg2 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    r1, ts1 = uuid.uuid4(), uuid.uuid4()
+    data = {
+        "lessons": [lu1, lu2],
+        "teachers": [1],
+        "class_groups": [cg1, cg2],
+        "study_groups": [],
+        "rooms": [r1],
+        "time_slots": [ts1],
+        "teacher_lessons": {1: {lu1, lu2}},
+        "class_group_lessons": {cg1: {lu1: 1}, cg2: {lu2: 1}},
+        "study_group_lessons": {},
+        "room_capacities": {r1: 30},
+        "class_group_sizes": {cg1: 10, cg2: 10},
+        "study_group_sizes": {},
+        "student_group_memberships": {},
+        "constraints": [],
+    }
+
+    with patch.object(
+        schedule_generator, "_encode", wraps=schedule_generator._encode
+    ) as encode:
+        status, message = ScheduleGenerator._run_solver(
+            data, None, 10, "glucose4", diagnose_timeout=2
+        )
+    assert status is False
+    assert "resource conflicts" in message
+    encode.assert_called_once()
+
+
+def test_validate_input_probe_skips_full_build():
+    """
+    validate_input without pre-built data rejects an institution with no rooms
+    from the existence probe alone.
+    """
+    gen = ScheduleGenerator(MagicMock())
+    present = {
+        "lessons": True,
+        "teachers": True,
+        "class_groups": True,
+        "study_groups": False,
+        "rooms": False,
+        "time_slots": True,
+    }
+    with patch.object(
+        gen.constraint_builder,
+        "probe_institution",
+        new_callable=AsyncMock,
+        return_value=present,
+    ), patch.object(
+        gen.constraint_builder, "build_from_institution", new_callable=AsyncMock
+    ) as build:
+        ok, err = _run(gen.validate_input(uuid.uuid4()))
+    assert ok is False
+    assert err == "No rooms found for this institution"
+    build.assert_not_awaited()
+
+
+def test_validate_input_reuses_result_for_same_data_key():
+    """Validating identical data (same fingerprint) twice runs the checks once."""
+    gen = ScheduleGenerator(MagicMock())
+    data = {"lessons": [], "teachers": [], "class_groups": [], "study_groups": []}
+    with patch.dict(schedule_generator._validation_cache, clear=True), patch.object(
+        schedule_generator,
+        "_check_input_data",
+        wraps=schedule_generator._check_input_data,
+    ) as check:
+        first = _run(gen.validate_input(uuid.uuid4(), data=data, data_key="k"))
+        second = _run(gen.validate_input(uuid.uuid4(), data=data, data_key="k"))
+    assert first == second == (False, "No lessons found for this institution")
+    check.assert_called_once()
+
+
+def test_unavailable_slots_get_no_variables():
+    """
+    Teacher/room unavailability is applied while creating variables, and a pair
+    left without any variable is reported as unavailable rather than as a
+    capacity problem.
+    """
+    lu1, cg1, r1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    ts1, ts2 = uuid.uuid4(), uuid.uuid4()
+    teacher_unavailability, room_unavailability = unavailable_slots(
+        [
+            {
+                "constraint_type": "teacher_unavailable",
+                "constraint_data": {"teacher_id": 1, "time_slot_ids": [ts1]},
+            },
+            {
+                "constraint_type": "room_unavailable",
+                "constraint_data": {"room_id": r1, "time_slot_ids": [ts2]},
+            },
+        ]
+    )
+    assert teacher_unavailability == {1: {ts1}}
+    assert room_unavailability == {r1: {ts2}}
+
+    def encode(**unavailability):
+        encoder = ScheduleEncoder()
+        encoder.encode_variables(
+            lessons=[lu1],
+            teachers=[1],
+            class_groups=[cg1],
+            study_groups=[],
+            rooms=[r1],
+            time_slots=[ts1, ts2],
+            teacher_lessons={1: {lu1}},
+            class_group_lessons={cg1: {lu1: 1}},
+            study_group_lessons={},
+            room_capacities={r1: 30},
+            class_group_sizes={cg1: 10},
+            study_group_sizes={},
+            **unavailability,
+        )
+        return encoder
+
+    partial = encode(teacher_unavailability=teacher_unavailability)
+    assert [key[4] for key in partial.get_variable_mapping()] == [ts2]
+
+    blocked = encode(
+        teacher_unavailability=teacher_unavailability,
+        room_unavailability=room_unavailability,
+    )
+    assert blocked.get_variable_mapping() == {}
+    assert blocked.get_infeasible_pairs({cg1: {lu1: 1}}, {}) == [
+        (lu1, cg1, "its teachers or rooms are unavailable in every time slot")
+    ]
+
+
+def test_solve_portfolio_returns_first_definite_answer():
+    """Every configured backend can win the portfolio race; UNSAT is definite too."""
+    lu1, lu2, cg1, cg2 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    r1, ts1 = uuid.uuid4(), uuid.uuid4()
+
+    def data(lessons):
+        # One teacher and one slot: a second (lesson, group) pair cannot fit.
+        groups = [cg1, cg2][: len(lessons)]
+        return {
+            "lessons": lessons,
+            "teachers": [1],
+            "class_groups": groups,
+            "study_groups": [],
+            "rooms": [r1],
+            "time_slots": [ts1],
+            "teacher_lessons": {1: set(lessons)},
+            "class_group_lessons": {g: {lu: 1} for g, lu in zip(groups, lessons)},
+            "study_group_lessons": {},
+            "room_capacities": {r1: 30},
+            "class_group_sizes": {g: 10 for g in groups},
+            "study_group_sizes": {},
+            "student_group_memberships": {},
+            "constraints": [],
+        }
+
+    gen = ScheduleGenerator(MagicMock())
+    with patch.object(
+        schedule_generator.settings,
+        "SCHEDULER_PORTFOLIO_SOLVERS",
+        ["glucose4", "minisat22"],
+    ):
+        sat = _run(gen._solve_portfolio(data([lu1]), 10))
+        unsat = _run(gen._solve_portfolio(data([lu1, lu2]), 10))
+        diagnosed = _run(gen._solve_portfolio(data([lu1, lu2]), 10, 2))
+    assert sat == (True, [(lu1, 1, cg1, None, r1, ts1)])
+    assert unsat == (False, None)
+    # The diagnostic drops the teacher conflict from the same encoding.
+    assert diagnosed[0] is False and "resource conflicts" in diagnosed[1]
+
+
+def test_solve_portfolio_skips_failed_backends():
+    """A backend that raises is left out of the race; only all failing raises."""
+    lu1, cg1, r1, ts1 = uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    data = {
+        "lessons": [lu1],
+        "teachers": [1],
+        "class_groups": [cg1],
+        "study_groups": [],
+        "rooms": [r1],
+        "time_slots": [ts1],
+        "teacher_lessons": {1: {lu1}},
+        "class_group_lessons": {cg1: {lu1: 1}},
+        "study_group_lessons": {},
+        "room_capacities": {r1: 30},
+        "class_group_sizes": {cg1: 10},
+        "study_group_sizes": {},
+        "student_group_memberships": {},
+        "constraints": [],
+    }
+
+    gen = ScheduleGenerator(MagicMock())
+    with patch.object(
+        schedule_generator.settings,
+        "SCHEDULER_PORTFOLIO_SOLVERS",
+        ["no-such-solver", "glucose4"],
+    ):
+        assert _run(gen._solve_portfolio(data, 10))[0] is True
+    with patch.object(
+        schedule_generator.settings, "SCHEDULER_PORTFOLIO_SOLVERS", ["no-such-solver"]
+    ):
+        with pytest.raises(RuntimeError, match="Every portfolio solver failed"):
+            _run(gen._solve_portfolio(data, 10))
+
+    with pytest.raises(ValueError, match="no-such-solver"):
+        Settings(SCHEDULER_PORTFOLIO_SOLVERS=["glucose4", "no-such-solver"])
+
+
+def test_generate_kills_solve_at_timeout():
+    """
+    A pigeonhole instance far beyond the timeout (13 lessons of one group in 12
+    slots) returns the timeout error on CaDiCaL, which cannot be interrupted,
+    by killing its solver process.
+    """
+    lessons = [uuid.uuid4() for _ in range(13)]
+    cg1, r1 = uuid.uuid4(), uuid.uuid4()
+    data = {
+        "lessons": lessons,
+        "teachers": list(range(1, 14)),
+        "class_groups": [cg1],
+        "study_groups": [],
+        "rooms": [r1],
+        "time_slots": [uuid.uuid4() for _ in range(12)],
+        "teacher_lessons": {i: {lu} for i, lu in enumerate(lessons, start=1)},
+        "class_group_lessons": {cg1: {lu: 1 for lu in lessons}},
+        "study_group_lessons": {},
+        "room_capacities": {r1: 30},
+        "class_group_sizes": {cg1: 10},
+        "study_group_sizes": {},
+        "student_group_memberships": {},
+        "constraints": [],
+    }
+
+    async def run_generate():
+        gen = ScheduleGenerator(MagicMock())
+        with patch.object(
+            gen.constraint_builder,
+            "build_from_institution",
+            new_callable=AsyncMock,
+            return_value=data,
+        ), patch.object(
+            schedule_generator.settings, "SCHEDULER_PORTFOLIO_SOLVERS", ["cadical153"]
+        ):
+            return await gen.generate(uuid.uuid4(), timeout=2)
+
+    with _record_solver_processes() as started:
+        ok, entries, err = _run(run_generate())
+    assert ok is False
+    assert "within 2 s" in err
+    assert [process.exitcode for process in started] == [-signal.SIGKILL]
+    assert not schedule_generator._solver_processes
+
+
+def test_call_in_process_kills_at_timeout_and_on_cancel():
+    """
+    A solver process is killed when its timeout passes and when the awaiting
+    call is cancelled (as asyncio.wait_for does), not when its work ends.
+    """
+    with _record_solver_processes() as started:
+        result = _run(schedule_generator._call_in_process(time.sleep, 30, timeout=1))
+    assert result == (False, None)
+    # Killed, not finished: a process that slept its 30 s would exit with 0.
+    assert [process.exitcode for process in started] == [-signal.SIGKILL]
+
+    async def cancelled_call():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(
+                schedule_generator._call_in_process(time.sleep, 30, timeout=30), 0.5
+            )
+
+    # asyncio.run only returns once the runner thread has reaped the process.
+    with _record_solver_processes() as started:
+        _run(cancelled_call())
+    assert [process.exitcode for process in started] == [-signal.SIGKILL]
+    assert not schedule_generator._solver_processes